@@ -30,35 +30,966 @@ import six
 
 import requests
 import json
-
+import threading
+import codecs
+import zlib
+import os
+
+from collections import deque
+from glob import glob
+from hashlib import sha1
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from functools import partial
+from io import BytesIO
+from twisted.internet import reactor, defer, error as twisted_error
+from twisted.internet.protocol import Protocol
+from twisted.internet.task import deferLater
+from twisted.python import threadable
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool as AgentConnectionPool, \
+    ResponseDone, ResponseFailed, RequestNotSent, RequestTransmissionFailed
+from twisted.web.http import PotentialDataLoss
+from twisted.web.http_headers import Headers
 from fcntl import ioctl
 from struct import pack
-from socket import socket, create_connection, AF_INET, SOCK_DGRAM, SHUT_RDWR, error as sockerror
-from . import config, saveConfigFile, getIceTVDeviceType, _
+from socket import socket, AF_INET, SOCK_DGRAM
+from random import uniform
+from . import config, saveConfigFile, getIceTVDeviceType, getIceTVDataFile, _
 from boxbranding import getMachineBrand, getMachineName, getImageBuild
+from time import time, sleep
 
 _version_string = "20221016"
 _protocol = "http://"
 _device_type_id = getIceTVDeviceType()
 _debug_level = 0  # 1 = request/reply, 2 = 1+headers, 3 = 2+partial body, 4 = 2+full body
+_TIMEOUT = 10.0  # Seconds to wait for a connection or data from the server
+_CACHE_TTL_HOUR = 60 * 60
+_CACHE_TTL_DAY = 24 * 60 * 60
 
 print("[IceTV] server set to", config.plugins.icetv.server.name.value)
 
+# Use a faster JSON codec than the standard library one if one is
+# installed. The codec is used to encode request bodies and to decode
+# complete responses. Streamed /shows responses are decoded
+# incrementally by JsonStreamDecoder, which needs the standard library
+# decoder.
+
+try:
+    import orjson
+
+    def _jsonDumps(obj):
+        return orjson.dumps(obj).decode("utf-8")
+
+    _jsonLoads = orjson.loads
+    _json_codec = "orjson"
+except ImportError:
+    try:
+        import ujson
+        _jsonDumps = ujson.dumps
+        _jsonLoads = ujson.loads
+        _json_codec = "ujson"
+    except ImportError:
+        _jsonDumps = json.dumps
+        _jsonLoads = json.loads
+        _json_codec = "json"
+
+print("[IceTV] using JSON codec", _json_codec)
+
+def _responseJson(response, **kwargs):
+    return _jsonLoads(response.content)
+
+def _wireBytes(response):
+    # Number of body bytes read from the connection, before any
+    # Content-Encoding is decoded
+    try:
+        return response.raw.tell()
+    except AttributeError:
+        return 0
+
 iceTVServers = {
     _("Australia"): "api.icetv.com.au",
     # IceTV is no longer available in Germany
     # _("Germany"): "api.icetv.de",
 }
 
-def isServerReachable():
-    try:
-        sock = create_connection((config.plugins.icetv.server.name.value, 80), 3)
-        sock.shutdown(SHUT_RDWR)
-        sock.close()
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitBreaker(object):
+    # Fails requests fast after failure_threshold consecutive failures.
+    # After reset_timeout seconds a single trial request is allowed
+    # through; the breaker closes again if it succeeds and stays open
+    # for another reset_timeout if it fails.
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trial = False
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.OPEN and time() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.trial = False
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self.trial):
+                return False
+            if self.state == self.HALF_OPEN:
+                self.trial = True
+            return True
+
+    def release(self):
+        # The allowed request was not sent or its outcome didn't
+        # reflect on this breaker
+        with self.lock:
+            self.trial = False
+
+    def success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                print("[IceTV] circuit breaker %s closed" % self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                print("[IceTV] circuit breaker %s opened after %d failures" % (self.name, self.failures))
+                self.state = self.OPEN
+                self.opened_at = time()
+
+    def retryDelay(self):
+        # Seconds until a trial request will be allowed, 0 if the
+        # breaker isn't open
+        with self.lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0, self.opened_at + self.reset_timeout - time())
+
+
+class RetryPolicy(object):
+    # Retries idempotent requests that fail because of a connection
+    # problem, a timeout or a server error, after a randomised
+    # ("full jitter") exponentially increasing delay.
+
+    IDEMPOTENT_METHODS = ("get", "head", "put", "delete")
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, retries, backoff, max_backoff):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def shouldRetry(self, method, attempt):
+        return method in self.IDEMPOTENT_METHODS and attempt < self.retries
+
+    def delay(self, attempt, response=None):
+        delay = uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if response is not None:
+            try:
+                delay = max(delay, min(self.max_backoff, float(response.headers.get("Retry-After", 0))))
+            except ValueError:
+                pass
+        return delay
+
+
+_retry_policy = RetryPolicy(retries=3, backoff=0.5, max_backoff=8.0)
+
+class ConcurrencyLimit(object):
+    # Additive increase, multiplicative decrease (AIMD) limit on the
+    # number of requests in flight at once.
+    # The limit grows by one after a window of "limit" requests has
+    # completed while the limit was in use and the latency stayed
+    # within latency_tolerance of the lowest latency seen. It is
+    # multiplied by decrease_factor when a request times out or gets
+    # a 429 or 5xx response, at most once for the requests that were
+    # in flight at the time.
+    # on_change(limit) is called whenever the limit changes.
+
+    def __init__(self, name, limit=1, max_limit=4, decrease_factor=0.5, latency_tolerance=1.5, on_change=None):
+        self.name = name
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.on_change = on_change
+        self.lock = threading.Lock()
+        self.limit = float(max(1, min(limit, max_limit)))
+        self.in_flight = 0
+        self.window = 0
+        self.min_latency = None
+        self.decreased_at = 0
+
+    def getLimit(self):
+        return int(self.limit)
+
+    def acquire(self, force=False):
+        # Returns True if another request may be sent now.
+        # force allows a request even if the limit has been reached.
+        with self.lock:
+            if not force and self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency=None):
+        # An acquired request has finished. latency is None if the
+        # request failed or its latency isn't comparable with others.
+        changed = False
+        with self.lock:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight = max(0, self.in_flight - 1)
+            if latency is None:
+                return
+            if self.min_latency is None or latency < self.min_latency:
+                self.min_latency = latency
+            elif latency > self.min_latency * self.latency_tolerance:
+                # Let the baseline follow lasting changes in the link
+                self.min_latency += (latency - self.min_latency) / 16
+                self.window = 0
+                return
+            if saturated and self.limit < self.max_limit:
+                self.window += 1
+                if self.window >= int(self.limit):
+                    self.window = 0
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    changed = True
+        if changed:
+            self._changed("increased")
+
+    def congested(self, sent_at):
+        # A request sent at time sent_at timed out or got a 429 or 5xx
+        # response
+        with self.lock:
+            if sent_at < self.decreased_at or self.limit <= 1:
+                return
+            self.limit = max(1.0, self.limit * self.decrease_factor)
+            self.window = 0
+            self.decreased_at = time()
+        self._changed("decreased")
+
+    def _changed(self, how):
+        print("[IceTV] %s concurrency limit %s to %d" % (self.name, how, self.getLimit()))
+        if self.on_change:
+            self.on_change(self.getLimit())
+
+# Connection failures and timeouts count against the whole server,
+# server errors only against the endpoint that returned them.
+_server_breaker = CircuitBreaker("server", failure_threshold=3, reset_timeout=30)
+_endpoint_breakers = {}
+_endpoint_breakers_lock = threading.Lock()
+
+def _getEndpointBreaker(endpoint):
+    with _endpoint_breakers_lock:
+        if endpoint not in _endpoint_breakers:
+            _endpoint_breakers[endpoint] = CircuitBreaker(endpoint, failure_threshold=5, reset_timeout=60)
+        return _endpoint_breakers[endpoint]
+
+def getRetryDelay():
+    # Seconds until requests will be tried again after circuit breakers
+    # have opened, 0 if no breaker is open
+    with _endpoint_breakers_lock:
+        breakers = [_server_breaker] + list(six.itervalues(_endpoint_breakers))
+    return max(b.retryDelay() for b in breakers)
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _connections.countNewConnection()
+        return super(_CountingHTTPConnectionPool, self)._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _connections.countNewConnection()
+        return super(_CountingHTTPSConnectionPool, self)._new_conn()
+
+
+class _CountingAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super(_CountingAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+class _CountingAgentConnectionPool(AgentConnectionPool):
+    def _newConnection(self, key, endpoint):
+        _connections.countNewConnection()
+        return AgentConnectionPool._newConnection(self, key, endpoint)
+
+
+class ConnectionPool(object):
+    # A requests.Session shared by all Request instances for blocking
+    # requests, and a twisted Agent for requests sent from the reactor,
+    # so that connections to the IceTV server are kept alive and reused.
+    # The session is replaced if it has been idle for longer than
+    # config.plugins.icetv.connection.idle_timeout or the pool size
+    # has been changed; the Agent's pool expires idle connections itself.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+        self.pool_size = 0
+        self.last_used = 0
+        self.agent = None
+        self.agent_pool = None
+        self.agent_config = None
+        self.requests = 0
+        self.new_connections = 0
+
+    def getAgent(self):
+        agent_config = (int(config.plugins.icetv.connection.pool_size.value), int(config.plugins.icetv.connection.idle_timeout.value))
+        with self.lock:
+            if self.agent is None or self.agent_config != agent_config:
+                if self.agent_pool is not None:
+                    self.agent_pool.closeCachedConnections()
+                self.agent_pool = _CountingAgentConnectionPool(reactor, persistent=True)
+                self.agent_pool.maxPersistentPerHost, self.agent_pool.cachedConnectionTimeout = agent_config
+                self.agent = Agent(reactor, connectTimeout=_TIMEOUT, pool=self.agent_pool)
+                self.agent_config = agent_config
+            self.requests += 1
+            return self.agent
+
+    def getSession(self):
+        pool_size = int(config.plugins.icetv.connection.pool_size.value)
+        idle_timeout = int(config.plugins.icetv.connection.idle_timeout.value)
+        with self.lock:
+            now = time()
+            if self.session is not None and (self.pool_size != pool_size or now - self.last_used > idle_timeout):
+                self.session.close()
+                self.session = None
+            if self.session is None:
+                adapter = _CountingAdapter(pool_connections=1, pool_maxsize=pool_size)
+                self.session = requests.Session()
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+                self.pool_size = pool_size
+            self.last_used = now
+            self.requests += 1
+            return self.session
+
+    def close(self):
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+            if self.agent_pool is not None:
+                self.agent_pool.closeCachedConnections()
+                self.agent_pool = None
+                self.agent = None
+
+    def countNewConnection(self):
+        with self.lock:
+            self.new_connections += 1
+
+    def getStats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": max(0, self.requests - self.new_connections),
+            }
+
+
+_connections = ConnectionPool()
+
+def getConnectionStats():
+    return _connections.getStats()
+
+def closeConnections():
+    _connections.close()
+
+def prewarmConnection():
+    # Open (or refresh) a kept-alive connection to the server ahead
+    # of a scheduled fetch, so the fetch doesn't pay for DNS lookup
+    # and connection setup. Must be called from the reactor thread.
+    def failed(failure):
+        print("[IceTV] Can not pre-warm connection:", failure.getErrorMessage())
+
+    prepared = requests.Request("HEAD", _protocol + config.plugins.icetv.server.name.value + "/").prepare()
+    return _agentRequest(prepared, False).addErrback(failed)
+
+
+class _ContentDecoder(object):
+    # Incrementally decodes a response body's Content-Encoding
+
+    def __init__(self, content_encoding):
+        self.content_encoding = (content_encoding or "").strip().lower()
+        self.decoder = None
+        self.finished = False
+
+    def decompress(self, data):
+        if self.content_encoding not in ("gzip", "deflate"):
+            return data
+        if self.decoder is None:
+            if self.content_encoding == "gzip":
+                self.decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            # Some servers send raw deflate data without a zlib header
+            elif (six.byte2int(data[:1]) & 0x0f) != 8:
+                self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            else:
+                self.decoder = zlib.decompressobj()
+        return self.decoder.decompress(data)
+
+    def flush(self):
+        # The rest of the decoded body, once, at the end of the body
+        if self.finished or self.decoder is None:
+            return b""
+        self.finished = True
+        return self.decoder.flush()
+
+
+class _BodyReader(object):
+    # File-like reader for a response body received by the twisted
+    # Agent. Like a urllib3 response, it decodes the Content-Encoding
+    # incrementally as the body is read, and tell() returns the number
+    # of body bytes read before decoding.
+
+    def __init__(self, body, content_encoding):
+        self.body = body
+        self.pos = 0
+        self.decoder = _ContentDecoder(content_encoding)
+
+    def read(self, amt=None):
+        # Only return an empty result at the end of the body
+        while True:
+            end = len(self.body) if amt is None else self.pos + amt
+            data = self.body[self.pos:end]
+            self.pos += len(data)
+            data = self.decoder.decompress(data) if data else self.decoder.flush()
+            if data or self.pos >= len(self.body):
+                return data
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.body = b""
+
+
+STREAM_BUFFER_SIZE = 256 * 1024  # Bytes of a streamed response body held before the download is paused
+
+class _StreamingBodyReader(Protocol):
+    # Receives a response body from the twisted Agent in the reactor
+    # thread, and lets it be read, decoded, from a worker thread as it
+    # arrives. When more than STREAM_BUFFER_SIZE bytes are waiting to
+    # be read, the download is paused until the reader catches up.
+    # Fails if no data arrives for _TIMEOUT seconds while the download
+    # isn't paused. read() must not be called in the reactor thread.
+
+    def __init__(self, content_encoding):
+        self.cond = threading.Condition()
+        self.chunks = deque()
+        self.buffered = 0
+        self.paused = False
+        self.done = False
+        self.error = None
+        self.lost = False
+        self.pos = 0
+        self.decoder = _ContentDecoder(content_encoding)
+        self.timer = reactor.callLater(_TIMEOUT, self.timedOut)
+
+    def dataReceived(self, data):
+        with self.cond:
+            if self.done:
+                return
+            self.chunks.append(data)
+            self.buffered += len(data)
+            pause = not self.paused and self.buffered > STREAM_BUFFER_SIZE
+            if pause:
+                self.paused = True
+            self.cond.notify()
+        # Data can still arrive after the download is paused, and
+        # the timer isn't running again until it is resumed
+        if pause:
+            if self.timer.active():
+                self.timer.cancel()
+            self.transport.pauseProducing()
+        elif self.timer.active():
+            self.timer.reset(_TIMEOUT)
+
+    def connectionLost(self, reason):
+        self.lost = True
+        if self.timer.active():
+            self.timer.cancel()
+        with self.cond:
+            if not self.done and not reason.check(ResponseDone, PotentialDataLoss):
+                self.error = requests.exceptions.ConnectionError(reason.getErrorMessage())
+            self.done = True
+            self.cond.notify()
+
+    def timedOut(self):
+        with self.cond:
+            self.error = requests.exceptions.Timeout("Timed out reading response")
+            self.done = True
+            self.cond.notify()
+        self.transport.stopProducing()
+
+    def resume(self):
+        # Runs in the reactor thread. The download may have been
+        # paused again before this runs.
+        with self.cond:
+            if self.paused or self.done:
+                return
+        if not self.lost:
+            if not self.timer.active():
+                self.timer = reactor.callLater(_TIMEOUT, self.timedOut)
+            self.transport.resumeProducing()
+
+    def stop(self):
+        # Runs in the reactor thread
+        if not self.lost:
+            if self.timer.active():
+                self.timer.cancel()
+            self.transport.stopProducing()
+
+    def read(self, amt=None):
+        # Blocks until data is available. Only returns an empty result
+        # at the end of the body.
+        while True:
+            resume = False
+            with self.cond:
+                while not self.chunks and not self.done:
+                    self.cond.wait()
+                if self.chunks:
+                    data = self.chunks.popleft()
+                    if amt is not None and len(data) > amt:
+                        self.chunks.appendleft(data[amt:])
+                        data = data[:amt]
+                    self.buffered -= len(data)
+                    if self.paused and self.buffered <= STREAM_BUFFER_SIZE // 2:
+                        self.paused = False
+                        resume = True
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    data = b""
+            if resume:
+                reactor.callFromThread(self.resume)
+            self.pos += len(data)
+            if not data:
+                return self.decoder.flush()
+            data = self.decoder.decompress(data)
+            if data:
+                return data
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        # Stop the download if it hasn't finished
+        with self.cond:
+            finished = self.done
+            self.done = True
+            self.chunks.clear()
+            self.buffered = 0
+            self.cond.notify()
+        if not finished:
+            reactor.callFromThread(self.stop)
+
+
+class _BodyReceiver(Protocol):
+    # Collects a response body delivered by the twisted Agent, failing
+    # if no data arrives for _TIMEOUT seconds.
+
+    def __init__(self, finished):
+        self.finished = finished
+        self.chunks = []
+        self.timer = reactor.callLater(_TIMEOUT, self.timedOut)
+
+    def dataReceived(self, data):
+        self.chunks.append(data)
+        if self.timer.active():
+            self.timer.reset(_TIMEOUT)
+
+    def connectionLost(self, reason):
+        if self.timer.active():
+            self.timer.cancel()
+        if self.finished.called:
+            return
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(b"".join(self.chunks))
+        else:
+            self.finished.errback(requests.exceptions.ConnectionError(reason.getErrorMessage()))
+
+    def timedOut(self):
+        self.finished.errback(requests.exceptions.Timeout("Timed out reading response"))
+        self.transport.stopProducing()
+
+
+def _agentRequest(prepared, stream):
+    # Send a requests.PreparedRequest using the twisted Agent.
+    # Returns a Deferred that fires with a requests.Response or fails
+    # with a requests exception, so that callers see the same results
+    # and errors as for a blocking request.
+    # The whole body is received before the Deferred fires, except for
+    # a successful response if stream is True: then the Deferred fires
+    # once the headers arrive, and the body is read from a worker
+    # thread as it is received.
+    headers = Headers()
+    for name, value in six.iteritems(prepared.headers):
+        if name.lower() not in ("host", "content-length", "connection"):
+            headers.setRawHeaders(six.ensure_binary(name), [six.ensure_binary(value)])
+    body = FileBodyProducer(BytesIO(six.ensure_binary(prepared.body))) if prepared.body else None
+    timed_out = []
+
+    def timeout(d):
+        timed_out.append(True)
+        d.cancel()
+
+    def gotResponse(response):
+        timer.cancel()
+        if stream and 200 <= response.code < 300:
+            reader = _StreamingBodyReader(six.ensure_str(response.headers.getRawHeaders(b"content-encoding", [b""])[0]))
+            response.deliverBody(reader)
+            return makeResponse(reader, response)
+        finished = defer.Deferred()
+        response.deliverBody(_BodyReceiver(finished))
+        return finished.addCallback(gotBody, response)
+
+    def gotBody(body, response):
+        r = makeResponse(None, response)
+        r.raw = _BodyReader(body, r.headers.get("Content-Encoding"))
+        if not stream:
+            r.content
+        return r
+
+    def makeResponse(raw, response):
+        r = requests.Response()
+        r.status_code = response.code
+        r.reason = six.ensure_str(response.phrase)
+        for name, values in response.headers.getAllRawHeaders():
+            r.headers[six.ensure_str(name)] = ", ".join(six.ensure_str(v) for v in values)
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+        r.url = prepared.url
+        r.request = prepared
+        r.raw = raw
+        return r
+
+    def failed(failure):
+        if timer.active():
+            timer.cancel()
+        if timed_out:
+            raise requests.exceptions.Timeout("Timed out waiting for %s" % prepared.url)
+        if failure.check(defer.CancelledError) or (failure.check(ResponseFailed) and any(reason.check(defer.CancelledError) for reason in failure.value.reasons)):
+            # Cancelled by the caller, so not to be retried
+            raise defer.CancelledError()
+        if failure.check(requests.exceptions.RequestException):
+            return failure
+        if failure.check(twisted_error.TimeoutError):
+            raise requests.exceptions.Timeout(failure.getErrorMessage())
+        if failure.check(twisted_error.ConnectError, twisted_error.DNSLookupError, twisted_error.ConnectionLost, ResponseFailed, RequestNotSent, RequestTransmissionFailed):
+            raise requests.exceptions.ConnectionError(failure.getErrorMessage())
+        return failure
+
+    d = _connections.getAgent().request(six.ensure_binary(prepared.method), six.ensure_binary(prepared.url), headers, body)
+    timer = reactor.callLater(_TIMEOUT, timeout, d)
+    d.addCallback(gotResponse)
+    d.addErrback(failed)
+    return d
+
+class ResponseCache(object):
+    # On-disk cache of GET responses for slowly changing resources,
+    # keyed by URL and query parameters. Each entry is stored in its
+    # own file as a line of JSON metadata followed by the response body.
+    # Entries with an ETag or Last-Modified validator are revalidated
+    # with a conditional GET, others are reused until their TTL expires.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def _filename(self, url, params):
+        key = json.dumps([url, sorted((str(k), str(v)) for k, v in six.iteritems(params))])
+        return getIceTVDataFile("response-%s.cache" % sha1(six.ensure_binary(key, "utf-8")).hexdigest())
+
+    def load(self, url, params):
+        try:
+            with self.lock:
+                with open(self._filename(url, params), "rb") as f:
+                    meta = json.loads(six.ensure_str(f.readline(), "utf-8"))
+                    meta["body"] = f.read()
+            return meta
+        except (IOError, OSError, ValueError):
+            return None
+
+    def store(self, url, params, response, ttl):
+        meta = {
+            "status": response.status_code,
+            "reason": response.reason,
+            "content_type": response.headers.get("Content-Type"),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "expires": int(time()) + ttl,
+        }
+        filename = self._filename(url, params)
+        try:
+            with self.lock:
+                with open(filename + ".tmp", "wb") as f:
+                    f.write(six.ensure_binary(json.dumps(meta), "utf-8") + b"\n")
+                    f.write(response.content)
+                os.rename(filename + ".tmp", filename)
+        except (IOError, OSError) as ex:
+            print("[IceTV] Can not save response cache:", str(ex))
+
+    def remove(self, url, params):
+        with self.lock:
+            try:
+                os.remove(self._filename(url, params))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self.lock:
+            for filename in glob(getIceTVDataFile("response-*.cache*")):
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def isFresh(entry):
+        return not entry.get("etag") and not entry.get("last_modified") and entry.get("expires", 0) > time()
+
+    @staticmethod
+    def addValidators(entry, headers):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    @staticmethod
+    def makeResponse(entry, request):
+        r = requests.Response()
+        r.status_code = entry["status"]
+        r.reason = entry["reason"]
+        if entry.get("content_type"):
+            r.headers["Content-Type"] = entry["content_type"]
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+        r._content = entry["body"]
+        r.url = request.url
+        r.request = request
+        r.from_cache = True
+        return r
+
+
+_response_cache = ResponseCache()
+
+def clearResponseCache():
+    _response_cache.clear()
+
+class JsonStreamDecoder(object):
+    # Incrementally decodes a JSON object of the form
+    # {"name": value, ..., "items": [item, item, ...], ...}
+    # from data fed to it in arbitrarily sized chunks.
+    # The elements of the top-level array named by stream_key are
+    # returned from feed() one at a time as soon as they have been
+    # completely received. Other top-level values are decoded into
+    # self.fields, with top-level arrays decoded element by element.
+
+    _WHITESPACE = " \t\r\n"
+    _DELIMITERS = _WHITESPACE + ",]}"
+
+    (_START, _KEY, _COLON, _VALUE, _AFTER_VALUE, _ARRAY_FIRST, _ELEMENT, _ARRAY_NEXT, _DONE) = range(9)
+
+    def __init__(self, stream_key):
+        self.stream_key = stream_key
+        self.fields = {}
+        self._json = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._state = self._START
+        self._key = None
+        self._final = False
+
+    def feed(self, data, final=False):
+        self._buf = self._buf[self._pos:] + self._text.decode(data, final)
+        self._pos = 0
+        self._final = final
+        items = []
+        while self._step(items):
+            pass
+        if final and self._state != self._DONE:
+            raise ValueError("Truncated JSON stream")
+        return items
+
+    def _skip(self):
+        # Skip whitespace, return the next character or None if
+        # more data is needed
+        buf = self._buf
+        while self._pos < len(buf) and buf[self._pos] in self._WHITESPACE:
+            self._pos += 1
+        return buf[self._pos] if self._pos < len(buf) else None
+
+    def _expect(self, expected):
+        raise ValueError("Unexpected %r in JSON stream, expecting %s" % (self._buf[self._pos], expected))
+
+    def _decode(self):
+        # Decode a complete value at self._pos, or return (False, None)
+        # if more data is needed. Numbers and literals must be followed
+        # by a delimiter unless the stream has ended, otherwise they
+        # may have been truncated at a chunk boundary.
+        try:
+            value, end = self._json.raw_decode(self._buf, self._pos)
+        except ValueError:
+            if self._final:
+                raise
+            return False, None
+        if not self._final and self._buf[self._pos] not in "{[\"" and (end >= len(self._buf) or self._buf[end] not in self._DELIMITERS):
+            return False, None
+        self._pos = end
+        return True, value
+
+    def _step(self, items):
+        state = self._state
+        if state == self._DONE:
+            return False
+        c = self._skip()
+        if c is None:
+            return False
+        if state == self._START:
+            if c != "{":
+                self._expect("{")
+            self._pos += 1
+            self._state = self._KEY
+        elif state == self._KEY:
+            if c == "}":
+                self._pos += 1
+                self._state = self._DONE
+                return True
+            if c != '"':
+                self._expect('"')
+            ok, self._key = self._decode()
+            if not ok:
+                return False
+            self._state = self._COLON
+        elif state == self._COLON:
+            if c != ":":
+                self._expect(":")
+            self._pos += 1
+            self._state = self._VALUE
+        elif state == self._VALUE:
+            if c == "[":
+                self._pos += 1
+                if self._key != self.stream_key:
+                    self.fields[self._key] = []
+                self._state = self._ARRAY_FIRST
+            else:
+                ok, value = self._decode()
+                if not ok:
+                    return False
+                self.fields[self._key] = value
+                self._state = self._AFTER_VALUE
+        elif state == self._AFTER_VALUE:
+            if c == ",":
+                self._state = self._KEY
+            elif c == "}":
+                self._state = self._DONE
+            else:
+                self._expect(", or }")
+            self._pos += 1
+        elif state == self._ARRAY_FIRST:
+            if c == "]":
+                self._pos += 1
+                self._state = self._AFTER_VALUE
+            else:
+                self._state = self._ELEMENT
+        elif state == self._ELEMENT:
+            ok, value = self._decode()
+            if not ok:
+                return False
+            if self._key == self.stream_key:
+                items.append(value)
+            else:
+                self.fields[self._key].append(value)
+            self._state = self._ARRAY_NEXT
+        elif state == self._ARRAY_NEXT:
+            if c == ",":
+                self._state = self._ELEMENT
+            elif c == "]":
+                self._state = self._AFTER_VALUE
+            else:
+                self._expect(", or ]")
+            self._pos += 1
         return True
-    except sockerror as ex:
-        print("[IceTV] Can not connect to IceTV server:", str(ex))
-    return False
+
+
+class ShowsStream(object):
+    # Iterating over a ShowsStream yields the shows in a /shows
+    # response one at a time as they are read from the connection,
+    # so that the whole response is never held in memory.
+    # last_update_time and timers are available once they have been
+    # read, which may not be until the iteration has finished.
+
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(self, response):
+        self.response = response
+        self.decoder = JsonStreamDecoder("shows")
+        # Response body size on the wire and after decoding
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        # Time spent waiting for the response body
+        self.read_time = 0.0
+        # Called with whether the whole response was read, when the
+        # stream is closed
+        self.on_close = []
+        self.closed = False
+
+    def __iter__(self):
+        completed = False
+        try:
+            # iter_content() decodes any Content-Encoding as it goes
+            chunks = self.response.iter_content(chunk_size=self.CHUNK_SIZE)
+            while True:
+                start = time()
+                chunk = next(chunks, None)
+                self.read_time += time() - start
+                if chunk is None:
+                    break
+                self.decoded_bytes += len(chunk)
+                for show in self.decoder.feed(chunk):
+                    yield show
+            for show in self.decoder.feed(b"", True):
+                yield show
+            completed = True
+        finally:
+            self.close(completed)
+
+    def close(self, completed=False):
+        if self.closed:
+            return
+        self.closed = True
+        self.wire_bytes = _wireBytes(self.response)
+        self.response.close()
+        callbacks, self.on_close = self.on_close, []
+        for callback in callbacks:
+            callback(completed)
+
+    def get(self, name, default=None):
+        return self.decoder.fields.get(name, default)
+
+    @property
+    def last_update_time(self):
+        return self.decoder.fields.get("last_update_time")
+
+    @property
+    def timers(self):
+        return self.decoder.fields.get("timers")
+
 
 def getMacAddress(ifname):
     result = "00:00:00:00:00:00"
@@ -86,6 +1017,7 @@ def clearCredentials():
     config.plugins.icetv.member.token.value = ""
     config.plugins.icetv.member.token.save()
     saveConfigFile()
+    clearResponseCache()
 
 def showIdToEventId(show_id):
     try:
@@ -105,20 +1037,132 @@ class Request(object):
         self.headers = {
             "Content-Type": "application/json",
             "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
             "User-Agent": "SystemPlugins.IceTV/%s (%s; %s; %s)" % (_version_string, getMachineBrand(), getMachineName(), getImageBuild()),
         }
         self.url = _protocol + config.plugins.icetv.server.name.value + resource
         self.data = {}
         self.response = None
+        # Response body size on the wire and after decoding
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        # Seconds to cache a GET response that has no validators.
+        # None if responses to the request are not cached.
+        self.cache_ttl = None
+        # ConcurrencyLimit told about timeouts and 429 or 5xx responses
+        self.concurrency_limit = None
+        self.sent_at = 0
 
     def _shorten(self, text):
         if len(text) < 4000:
             return text
         return text[:2000] + "\n...\n" + text[-2000:]
 
-    def send(self, method):
-        data = json.dumps(self.data)
-        r = requests.request(method, self.url, params=self.params, headers=self.headers, data=data, verify=False, timeout=10.0)
+    def _allowRequest(self, breaker):
+        # Fail fast while the server or endpoint circuit breaker is open
+        if not _server_breaker.allow():
+            raise CircuitOpenError("IceTV server unavailable, retry in %d seconds" % _server_breaker.retryDelay())
+        if not breaker.allow():
+            _server_breaker.release()
+            raise CircuitOpenError("IceTV %s unavailable, retry in %d seconds" % (breaker.name, breaker.retryDelay()))
+
+    def _requestFailed(self, breaker, method, attempt, ex, retry=True):
+        # Returns the delay before retrying a request that failed with
+        # a connection error or timeout, or None if it isn't retried
+        _server_breaker.failure()
+        breaker.release()
+        if self.concurrency_limit is not None and isinstance(ex, requests.exceptions.Timeout):
+            self.concurrency_limit.congested(self.sent_at)
+        if not retry or not _retry_policy.shouldRetry(method, attempt):
+            return None
+        print("[IceTV] %s %s failed: %s" % (method.upper(), self.url, str(ex)))
+        return _retry_policy.delay(attempt)
+
+    def _responseReceived(self, breaker, method, attempt, r, retry=True):
+        # Returns the delay before retrying a request that received
+        # a response, or None if the response is final
+        _server_breaker.success()
+        if r.status_code not in _retry_policy.RETRY_STATUS:
+            breaker.success()
+            return None
+        breaker.failure()
+        if self.concurrency_limit is not None:
+            self.concurrency_limit.congested(self.sent_at)
+        if not retry or not _retry_policy.shouldRetry(method, attempt):
+            return None
+        print("[IceTV] %s %s failed: %d %s" % (method.upper(), self.url, r.status_code, r.reason))
+        r.close()
+        return _retry_policy.delay(attempt, r)
+
+    def _request(self, method, headers, data, stream):
+        # Send the request, retrying according to _retry_policy.
+        # Blocking requests sent from the reactor thread (from screens)
+        # aren't retried, so that the GUI isn't held up for the retries.
+        breaker = _getEndpointBreaker(self.__class__.__name__)
+        retry = not threadable.isInIOThread()
+        attempt = 0
+        while True:
+            self._allowRequest(breaker)
+            self.sent_at = time()
+            try:
+                r = _connections.getSession().request(method, self.url, params=self.params, headers=headers, data=data, verify=False, timeout=_TIMEOUT, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+                delay = self._requestFailed(breaker, method, attempt, ex, retry)
+                if delay is None:
+                    raise
+            else:
+                delay = self._responseReceived(breaker, method, attempt, r, retry)
+                if delay is None:
+                    return r
+            print("[IceTV] retrying in %.1f seconds" % delay)
+            attempt += 1
+            sleep(delay)
+
+    @defer.inlineCallbacks
+    def _requestDeferred(self, method, headers, data, stream):
+        # As for _request(), but sent from the reactor thread using the
+        # twisted Agent
+        breaker = _getEndpointBreaker(self.__class__.__name__)
+        prepared = requests.Request(method.upper(), self.url, params=self.params, headers=headers, data=data).prepare()
+        attempt = 0
+        while True:
+            self._allowRequest(breaker)
+            self.sent_at = time()
+            try:
+                r = yield _agentRequest(prepared, stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+                delay = self._requestFailed(breaker, method, attempt, ex)
+                if delay is None:
+                    raise
+            else:
+                delay = self._responseReceived(breaker, method, attempt, r)
+                if delay is None:
+                    defer.returnValue(r)
+            print("[IceTV] retrying in %.1f seconds" % delay)
+            attempt += 1
+            yield deferLater(reactor, delay, lambda: None)
+
+    def _checkCache(self, method):
+        # Returns the headers to send, the cache entry to use for a
+        # 304 Not Modified reply and the response to use without
+        # sending the request, if the cached response is still fresh
+        headers = self.headers
+        cache_entry = None
+        if self.cache_ttl is not None and method == "get":
+            cache_entry = _response_cache.load(self.url, self.params)
+            if cache_entry is not None:
+                if ResponseCache.isFresh(cache_entry):
+                    r = ResponseCache.makeResponse(cache_entry, requests.Request(method.upper(), self.url, params=self.params).prepare())
+                    if _debug_level > 0:
+                        print("[IceTV]", r.request.method, r.request.url, "(cached)")
+                    r.json = partial(_responseJson, r)
+                    self.response = r
+                    return headers, cache_entry, r
+                headers = dict(headers)
+                ResponseCache.addValidators(cache_entry, headers)
+        return headers, cache_entry, None
+
+    def _processResponse(self, r, method, cache_entry, stream):
         err = not r.ok
         if err or _debug_level > 0:
             print("[IceTV]", r.request.method, r.request.url)
@@ -132,16 +1176,52 @@ class Request(object):
             print("[IceTV]", r.status_code, r.reason)
         if err or _debug_level > 1:
             print("[IceTV] headers", r.headers)
-        if err or _debug_level == 3:
+        # Reading the text of a streamed response would read the whole body
+        if err or (_debug_level == 3 and not stream):
             print("[IceTV]", self._shorten(r.text))
-        elif err or _debug_level > 3:
+        elif _debug_level > 3 and not stream:
             print("[IceTV]", r.text)
+        if not stream:
+            self.wire_bytes = _wireBytes(r)
+        if r.status_code == 304 and cache_entry is not None:
+            r = ResponseCache.makeResponse(cache_entry, r.request)
+        elif r.ok and self.cache_ttl is not None:
+            if method == "get":
+                _response_cache.store(self.url, self.params, r, self.cache_ttl)
+            else:
+                _response_cache.remove(self.url, self.params)
+        if not stream:
+            self.decoded_bytes = len(r.content)
+            if _debug_level > 0:
+                print("[IceTV] %d bytes on the wire, %d bytes decoded" % (self.wire_bytes, self.decoded_bytes))
+        r.json = partial(_responseJson, r)
         self.response = r
         if r.status_code == 401:
             clearCredentials()
         r.raise_for_status()
         return r
 
+    def send(self, method, stream=False):
+        headers, cache_entry, r = self._checkCache(method)
+        if r is not None:
+            return r
+        r = self._request(method, headers, _jsonDumps(self.data), stream)
+        return self._processResponse(r, method, cache_entry, stream)
+
+    def sendDeferred(self, method, stream=False):
+        # Non-blocking send(), for use in the reactor thread.
+        # Returns a Deferred that fires with the response, or fails
+        # with the same exceptions that send() raises.
+        try:
+            headers, cache_entry, r = self._checkCache(method)
+        except Exception:
+            return defer.fail()
+        if r is not None:
+            return defer.succeed(r)
+        d = self._requestDeferred(method, headers, _jsonDumps(self.data), stream)
+        d.addCallback(self._processResponse, method, cache_entry, stream)
+        return d
+
 
 class AuthRequest(Request):
     def __init__(self, resource):
@@ -152,6 +1232,7 @@ class AuthRequest(Request):
 class Regions(Request):
     def __init__(self):
         super(Regions, self).__init__("/regions")
+        self.cache_ttl = _CACHE_TTL_DAY
 
     def get(self):
         return self.send("get")
@@ -160,6 +1241,7 @@ class Regions(Request):
 class Region(Request):
     def __init__(self, region):
         super(Region, self).__init__("/regions/" + str(int(region)))
+        self.cache_ttl = _CACHE_TTL_DAY
 
     def get(self):
         return self.send("get")
@@ -171,6 +1253,7 @@ class Channels(Request):
             super(Channels, self).__init__("/regions/channels")
         else:
             super(Channels, self).__init__("/regions/" + str(int(region)) + "/channels")
+        self.cache_ttl = _CACHE_TTL_DAY
 
     def get(self):
         return self.send("get")
@@ -182,6 +1265,7 @@ class UserChannels(AuthRequest):
             super(UserChannels, self).__init__("/regions/channels")
         else:
             super(UserChannels, self).__init__("/regions/" + str(int(region)) + "/channels")
+        self.cache_ttl = _CACHE_TTL_HOUR
 
     def get(self):
         return self.send("get")
@@ -210,6 +1294,7 @@ class Login(Request):
 
     def send(self, method):
         r = super(Login, self).send(method)
+        clearResponseCache()
         result = r.json()
         config.plugins.icetv.member.email_address.value = result["member"]["email_address"]
         config.plugins.icetv.member.token.value = result["member"]["token"]
@@ -300,6 +1385,12 @@ class Shows(AuthRequest):
     def get(self):
         return self.send("get")
 
+    def stream(self):
+        return ShowsStream(self.send("get", stream=True))
+
+    def streamDeferred(self):
+        return self.sendDeferred("get", stream=True).addCallback(ShowsStream)
+
 
 class Timers(AuthRequest):
     def __init__(self):
@@ -340,6 +1431,7 @@ class Scans(AuthRequest):
 class Settings(AuthRequest):
     def __init__(self):
         super(Settings, self).__init__("/user/settings")
+        self.cache_ttl = _CACHE_TTL_HOUR
 
     def get(self):
         return self.send("get")
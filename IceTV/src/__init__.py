@@ -27,15 +27,22 @@ along with IceTV Plugin.  If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import print_function, division
 
-from enigma import eEPGCache
+from enigma import eEPGCache, eTimer
 from boxbranding import getMachineBrand, getMachineName
 from Components.config import config, ConfigSubsection, ConfigNumber, ConfigText, \
     ConfigPassword, ConfigSelection, NoSave, configfile, ConfigYesNo, \
     ConfigSelectionNumber
-from Tools.Directories import resolveFilename, SCOPE_CURRENT_SKIN, SCOPE_PLUGINS
+from Tools.Directories import resolveFilename, SCOPE_CURRENT_SKIN, SCOPE_PLUGINS, SCOPE_CONFIG
 from Tools.LoadPixmap import LoadPixmap
+import os
 import os.path
+import json
+from hashlib import sha1
+from time import time
+import threading
+from twisted.internet import reactor, threads
 from Components.Language import language
+import NavigationInstance
 from Tools.Directories import resolveFilename, SCOPE_PLUGINS
 import gettext
 
@@ -88,6 +95,9 @@ config.plugins.icetv.device.label = ConfigText(default="%s %s" % (getMachineBran
 config.plugins.icetv.device.id = ConfigNumber()
 config.plugins.icetv.device.type_id = ConfigNumber(default=getIceTVDeviceType())
 
+# last_update_time is not saved in the settings file. It is restored
+# from the sync state (see loadSyncState()) when the EPG cache still
+# holds the EPG that it was saved with.
 config.plugins.icetv.last_update_time = ConfigNumber()
 if config.plugins.icetv.last_update_time.value != 0:
     config.plugins.icetv.last_update_time.value = 0
@@ -128,6 +138,20 @@ config.plugins.icetv.refresh_interval = ConfigSelection(default="%d" % int(minut
 
 config.plugins.icetv.max_batchsize = ConfigSelectionNumber(0, 50, 1, default=30)
 
+# Persistent HTTP connections to the IceTV server.
+# pool_size is the maximum number of kept-alive connections,
+# idle_timeout (seconds) is how long an unused connection pool is
+# kept before it is discarded and new connections are made.
+
+config.plugins.icetv.connection = ConfigSubsection()
+config.plugins.icetv.connection.pool_size = ConfigSelectionNumber(1, 10, 1, default=4)
+config.plugins.icetv.connection.idle_timeout = ConfigSelectionNumber(15, 300, 15, default=60)
+
+# Number of /shows batch requests sent in parallel, as learned by
+# the adaptive concurrency limit during previous updates
+
+config.plugins.icetv.connection.shows_concurrency = ConfigNumber(default=1)
+
 def saveConfigFile():
     config.plugins.icetv.save()
     configfile.save()
@@ -140,7 +164,7 @@ def enableIceTV():
         epgcache.clear()
     except AttributeError:
         epgcache.flushEPG()
-    epgcache.save()
+    epg_save_scheduler.cleared()
     saveConfigFile()
 
 def disableIceTV():
@@ -150,7 +174,7 @@ def disableIceTV():
         epgcache.clear()
     except AttributeError:
         epgcache.flushEPG()
-    epgcache.save()
+    epg_save_scheduler.cleared()
     epgcache.setEpgSources(eEPGCache.NOWNEXT | eEPGCache.SCHEDULE | eEPGCache.SCHEDULE_OTHER)
     restoreDefaults()
     saveConfigFile()
@@ -158,6 +182,7 @@ def disableIceTV():
 def setIceTVDefaults():
     config.plugins.icetv.enable_epg.value = True
     config.plugins.icetv.last_update_time.value = 0
+    clearSyncState()
     config.epg.eit.value = False
     config.epg.save()
     config.usage.show_eit_nownext.value = False
@@ -170,6 +195,212 @@ def restoreDefaults():
     config.epg.save()
     config.plugins.icetv.enable_epg.value = False
     config.plugins.icetv.last_update_time.value = 0
+    clearSyncState()
+
+def getIceTVDataFile(filename):
+    # Files that IceTV keeps between restarts live in their own
+    # directory in the enigma2 configuration directory
+    dirname = resolveFilename(SCOPE_CONFIG, "icetv")
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    return os.path.join(dirname, filename)
+
+# The sync state records the last_update_time of the EPG that was in
+# the EPG cache when the cache was saved, along with a sample of the
+# events imported, so that it can be checked against the EPG cache
+# after a restart, and the fingerprints of the shows imported, so that
+# unchanged shows aren't imported again.
+
+SYNC_STATE_VERSION = 3
+
+def _getSyncStateFile():
+    return getIceTVDataFile("syncstate.json")
+
+def getEPGCacheFile():
+    try:
+        return config.misc.epgcache_filename.value
+    except AttributeError:
+        return None
+
+def _getSyncIdentity():
+    # The EPG in the cache only applies to this account and region
+    return {
+        "server": config.plugins.icetv.server.name.value,
+        "member_id": config.plugins.icetv.member.id.value,
+        "region_id": config.plugins.icetv.member.region_id.value,
+        "country": config.plugins.icetv.member.country.value,
+    }
+
+def saveSyncState(last_update_time, watermarks, sample, fingerprints, saved_at=None):
+    # Call after the EPG cache has been saved. watermarks maps
+    # channel_id to the last_update_time fetched for the channel,
+    # sample is a list of [channel_id, service_ref, event_id, end]
+    # for imported events, and fingerprints is the state of the
+    # EventFingerprints for the imported shows. saved_at is when the
+    # EPG cache was saved, if that wasn't just now.
+    if not last_update_time:
+        clearSyncState()
+        return
+    state = json.dumps({
+        "version": SYNC_STATE_VERSION,
+        "identity": _getSyncIdentity(),
+        "last_update_time": last_update_time,
+        "watermarks": dict((str(channel_id), watermark) for channel_id, watermark in watermarks.items()),
+        "saved_at": int(saved_at or time()),
+        "epg_file": getEPGCacheFile(),
+        "sample": sample,
+        "fingerprints": fingerprints,
+    }, sort_keys=True)
+    filename = _getSyncStateFile()
+    try:
+        with open(filename + ".tmp", "w") as f:
+            json.dump({"checksum": sha1(state.encode("utf-8")).hexdigest(), "state": state}, f)
+        os.rename(filename + ".tmp", filename)
+    except (IOError, OSError) as ex:
+        print("[IceTV] can't save sync state:", ex)
+
+def loadSyncState():
+    # Returns the saved sync state, or None if there isn't one or it
+    # can't be used
+    filename = _getSyncStateFile()
+    try:
+        with open(filename) as f:
+            data = json.load(f)
+        state = data["state"]
+        if sha1(state.encode("utf-8")).hexdigest() != data["checksum"]:
+            print("[IceTV] sync state checksum mismatch")
+            return None
+        state = json.loads(state)
+    except (IOError, OSError):
+        return None
+    except (ValueError, KeyError, TypeError, AttributeError) as ex:
+        print("[IceTV] can't load sync state:", ex)
+        return None
+    if state.get("version") != SYNC_STATE_VERSION or state.get("identity") != _getSyncIdentity():
+        print("[IceTV] sync state is for a different version or account")
+        return None
+    epg_file = getEPGCacheFile()
+    if state.get("epg_file") != epg_file:
+        print("[IceTV] sync state is for a different EPG cache file")
+        return None
+    # The EPG cache file may be removed when it is loaded, but if it
+    # is there it must not be older than the sync state
+    if epg_file and os.path.exists(epg_file) and os.path.getmtime(epg_file) < state["saved_at"] - 60:
+        print("[IceTV] EPG cache file is older than the sync state")
+        return None
+    return state
+
+def clearSyncState():
+    try:
+        os.remove(_getSyncStateFile())
+    except OSError:
+        pass
+
+class EPGSaveScheduler(object):
+    # Saving the EPG cache writes the whole cache file, so saves are
+    # held back until enough events have been imported or deleted, or
+    # until the oldest unsaved change is old enough, and they are put
+    # off while recordings are being written.
+
+    CHANGE_THRESHOLD = 5000  # Events imported or deleted
+    MAX_STALENESS = 2 * 60 * 60  # Seconds
+    RECORDING_RETRY = 5 * 60  # Seconds
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.changes = 0
+        self.dirty_since = None
+        self.saved_at = None
+        self.on_save = None
+        self.timer = None
+
+    def changed(self, count, on_save=None):
+        # Record count events imported or deleted. on_save(saved_at)
+        # is called once the EPG cache holding the changes has been
+        # saved; if there are no unsaved changes, it is called now.
+        # May be called from any thread.
+        with self.lock:
+            if count:
+                self.changes += count
+                if self.dirty_since is None:
+                    self.dirty_since = time()
+            dirty = self.dirty_since is not None
+            if dirty:
+                self.on_save = on_save
+        if dirty:
+            reactor.callFromThread(self.check)
+        elif on_save is not None:
+            on_save(self.getSavedAt())
+
+    def cleared(self):
+        # The whole EPG cache has been cleared
+        with self.lock:
+            self.changes = max(self.changes, self.CHANGE_THRESHOLD)
+            if self.dirty_since is None:
+                self.dirty_since = time()
+            self.on_save = None
+        reactor.callFromThread(self.check)
+
+    def getSavedAt(self):
+        # When the EPG cache file was last saved, if known
+        if self.saved_at is None:
+            epg_file = getEPGCacheFile()
+            if epg_file and os.path.exists(epg_file):
+                return os.path.getmtime(epg_file)
+        return self.saved_at
+
+    def isRecording(self):
+        try:
+            return bool(NavigationInstance.instance.getRecordings())
+        except AttributeError:
+            return False
+
+    def startTimer(self, delay):
+        if self.timer is None:
+            self.timer = eTimer()
+            self.timer.callback.append(self.check)
+        self.timer.startLongTimer(max(1, int(delay)))
+
+    def check(self):
+        # Runs in the reactor thread
+        with self.lock:
+            if self.dirty_since is None:
+                return
+            age = time() - self.dirty_since
+            due = self.changes >= self.CHANGE_THRESHOLD or age >= self.MAX_STALENESS
+        if not due:
+            self.startTimer(self.MAX_STALENESS - age)
+        elif self.isRecording():
+            print("[IceTV] EPG cache save put off while recording")
+            self.startTimer(self.RECORDING_RETRY)
+        else:
+            if self.timer is not None:
+                self.timer.stop()
+            threads.deferToThread(self.save)
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                if self.dirty_since is None:
+                    return
+                changes, age, on_save = self.changes, time() - self.dirty_since, self.on_save
+                self.changes = 0
+                self.dirty_since = None
+                self.on_save = None
+            eEPGCache.getInstance().save()
+            self.saved_at = time()
+            print("[IceTV] saved EPG cache: %d changes over %ds" % (changes, age))
+            if on_save is not None:
+                on_save(self.saved_at)
+
+    def flush(self):
+        # Save any unsaved changes now, at shutdown
+        if self.timer is not None:
+            self.timer.stop()
+        self.save()
+
+epg_save_scheduler = EPGSaveScheduler()
 
 def loadIceTVIcon(iconname):
     for scope, path in ((SCOPE_CURRENT_SKIN, "icons"), (SCOPE_PLUGINS, "SystemPlugins/IceTV/icons")):
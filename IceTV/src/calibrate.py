@@ -0,0 +1,250 @@
+# kate: replace-tabs on; indent-width 4; remove-trailing-spaces all; show-tabs on; newline-at-eof on;
+# -*- coding:utf-8 -*-
+
+'''
+Copyright 2014-2021 Peter Urbanec
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+For alternate licensing options contact enigma.licensing (at) urbanec.net
+
+This file is part of IceTV Plugin for enigma2.
+
+IceTV Plugin is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+IceTV Plugin is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with IceTV Plugin.  If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+# Calibration of the EPG fetch batch size.
+#
+# Streams a recorded or synthetic /shows payload through the same
+# decoding and conversion that EPGFetcher uses, with the EPG import
+# stubbed out, for a range of batch sizes and numbers of days, and
+# measures the time and the RSS increase for each, both at its peak
+# during the conversion and once the converted events are held. The results give the
+# recommended max_batchsize for the device type, and are merged into
+# calibration.json in the IceTV data directory so that runs on
+# different models can be collected into one table.
+# The RSS measurements are only meaningful while no EPG fetch is
+# running.
+
+from __future__ import print_function, division
+import six
+
+import gc
+import json
+
+from collections import defaultdict
+from os import path, rename
+from time import time
+from . import config, getIceTVDeviceType, getIceTVDataFile
+from . import API as ice
+from .memory import getMemAvailable, getPeakRSS, getRSS
+from .plugin import BatchSizeTuner
+
+# A recorded /shows response body can be put here to calibrate
+# against real EPG data instead of synthetic shows
+PAYLOAD_FILE = "calibration_shows.json"
+RESULTS_FILE = "calibration.json"
+
+BATCH_SIZES = (1, 5, 10, 20, 30, 50)
+DAY_HORIZONS = (1, 7, 14)
+MAX_BATCHSIZE_LIMIT = 50  # Upper limit of config.plugins.icetv.max_batchsize
+RSS_SAMPLE_INTERVAL = 200  # Shows converted between RSS samples
+
+def makeSyntheticShows(channels, days, shows_per_day=40):
+    # Generates shows like those in a /shows response, with typical
+    # field sizes
+    start = (int(time()) // 3600) * 3600
+    duration = 86400 // shows_per_day
+    show_id = 1
+    for channel_id in range(1, channels + 1):
+        for i in range(days * shows_per_day):
+            yield {
+                "id": str(show_id),
+                "channel_id": str(channel_id),
+                "title": "Show title %d" % show_id,
+                "subtitle": "Episode subtitle %d" % i,
+                "desc": "A description of the show, of the length typically found in the EPG. " * 4,
+                "start_unix": start + i * duration,
+                "stop_unix": start + (i + 1) * duration,
+                "category": [{"name": "News", "eit": "0x20"}, {"name": "Current Affairs", "eit": "0x81"}],
+                "rating": "G",
+            }
+            show_id += 1
+
+def loadPayload(filename):
+    # The shows in a recorded /shows response by channel, or None if
+    # there isn't one
+    if not path.exists(filename):
+        return None
+    with open(filename) as f:
+        shows = json.load(f).get("shows", [])
+    by_channel = defaultdict(list)
+    for show in shows:
+        by_channel[show["channel_id"]].append(show)
+    return [sorted(channel_shows, key=lambda s: int(s.get("start_unix", 0))) for channel_shows in six.itervalues(by_channel)]
+
+def selectShows(payload, channels, days):
+    # Generates the shows for the given number of channels and days
+    # from a recorded payload. Channels are reused under new ids if the
+    # payload doesn't have enough of them.
+    if not payload:
+        return
+    for n in range(channels):
+        source = payload[n % len(payload)]
+        first = int(source[0].get("start_unix", 0))
+        for show in source:
+            if int(show.get("start_unix", 0)) < first + days * 86400:
+                show = dict(show)
+                show["channel_id"] = str(n + 1)
+                yield show
+
+class PayloadResponse(object):
+    # Stands in for the response to a /shows request, generating its
+    # body as it is read, so that the whole body is never held in
+    # memory
+
+    def __init__(self, shows):
+        self.shows = shows
+
+    def iter_content(self, chunk_size):
+        parts = [b'{"shows": [']
+        size = len(parts[0])
+        for i, show in enumerate(self.shows):
+            part = six.ensure_binary((", " if i else "") + json.dumps(show))
+            parts.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                data = b"".join(parts)
+                for pos in range(0, len(data), chunk_size):
+                    yield data[pos:pos + chunk_size]
+                parts = []
+                size = 0
+        parts.append(b'], "last_update_time": 0}')
+        yield b"".join(parts)
+
+    def close(self):
+        self.shows = None
+
+class BatchSizeCalibration(object):
+    def __init__(self, fetcher, batch_sizes=BATCH_SIZES, day_horizons=DAY_HORIZONS):
+        self.fetcher = fetcher
+        self.batch_sizes = batch_sizes
+        self.day_horizons = day_horizons
+        self.payload = loadPayload(getIceTVDataFile(PAYLOAD_FILE))
+        self.device_type = getIceTVDeviceType()
+        self.measurements = []
+
+    def importEvents(self, services, events):
+        # Stands in for eEPGCache.importEvents()
+        self.imported += len(events)
+
+    def measure(self, channels, days):
+        if self.payload is None:
+            shows = ice.ShowsStream(PayloadResponse(makeSyntheticShows(channels, days)))
+        else:
+            shows = ice.ShowsStream(PayloadResponse(selectShows(self.payload, channels, days)))
+        genre_resolver = self.fetcher.getGenreResolver()
+        gc.collect()
+        self.imported = 0
+        count = 0
+        rss_before = getRSS()
+        # The process's peak RSS can only be used if this run goes
+        # above it, otherwise the peak is from sampling the RSS
+        hwm_before = getPeakRSS()
+        peak = rss_before
+        start = time()
+        # As for a batch in EPGFetcher.processShowsBatched(), the shows
+        # are converted as they are decoded, then imported by channel
+        channel_event_map = defaultdict(list)
+        for show in shows:
+            count += 1
+            event = self.fetcher.convertShow(show, genre_resolver)
+            if event is not None:
+                channel_event_map[int(show["channel_id"])].append(event)
+            if peak is not None and count % RSS_SAMPLE_INTERVAL == 0:
+                peak = max(peak, getRSS() or 0)
+        # The converted events for the batch are all in memory
+        rss = getRSS()
+        hwm = getPeakRSS()
+        if peak is not None and rss is not None:
+            peak = max(peak, rss)
+            if hwm is not None and hwm_before is not None and hwm > hwm_before:
+                peak = max(peak, hwm)
+        for channel_id, events in six.iteritems(channel_event_map):
+            self.importEvents([], events)
+        elapsed = time() - start
+        del channel_event_map
+        return {
+            "channels": channels,
+            "days": days,
+            "shows": count,
+            "events": self.imported,
+            "seconds": round(elapsed, 3),
+            "rss_kB": rss - rss_before if rss is not None and rss_before is not None else None,
+            "peak_rss_kB": peak - rss_before if peak is not None and rss is not None else None,
+            "decoded_bytes": shows.decoded_bytes,
+        }
+
+    def run(self):
+        # Returns the results for this device type
+        self.measurements = [self.measure(channels, days) for days in self.day_horizons for channels in self.batch_sizes]
+        kb_per_channel_day = {}
+        for m in self.measurements:
+            # As measured by BatchSizeTuner.record(), but from the
+            # peak RSS, which the batch must also fit in
+            kb = max(m["peak_rss_kB"] or 0, m["rss_kB"] or 0, m["decoded_bytes"] / 1024.0) / (m["channels"] * m["days"])
+            kb_per_channel_day[m["days"]] = max(kb_per_channel_day.get(m["days"], 0), kb)
+        memkB = getMemAvailable()
+        max_batchsize = None
+        if memkB is not None:
+            # Enough for a full fetch of the longest horizon measured
+            days = max(self.day_horizons)
+            kb = max(kb_per_channel_day[days], 1)
+            max_batchsize = int((memkB - BatchSizeTuner.HEADROOM) // (days * kb * BatchSizeTuner.SAFETY))
+            max_batchsize = max(1, min(MAX_BATCHSIZE_LIMIT, max_batchsize))
+        results = {
+            "max_batchsize": max_batchsize,
+            "mem_available_kB": memkB,
+            "payload": "synthetic" if self.payload is None else "recorded",
+            "kb_per_channel_day": dict((str(days), round(kb, 1)) for days, kb in six.iteritems(kb_per_channel_day)),
+            "measurements": self.measurements,
+        }
+        self.save(results)
+        return results
+
+    def save(self, results):
+        filename = getIceTVDataFile(RESULTS_FILE)
+        try:
+            with open(filename) as f:
+                table = json.load(f)
+        except (IOError, OSError, ValueError):
+            table = {}
+        table[str(self.device_type)] = results
+        try:
+            with open(filename + ".tmp", "w") as f:
+                json.dump(table, f, indent=1, sort_keys=True)
+            rename(filename + ".tmp", filename)
+        except (IOError, OSError) as ex:
+            print("[IceTV] can't save calibration results:", ex)
+
+    def report(self, results):
+        lines = ["Device type %s, %s payload, %s kB available" % (self.device_type, results["payload"], results["mem_available_kB"])]
+        lines.append("%8s %4s %7s %8s %10s %12s %12s" % ("channels", "days", "shows", "seconds", "RSS kB", "peak RSS kB", "decoded kB"))
+        for m in results["measurements"]:
+            lines.append("%8d %4d %7d %8.2f %10s %12s %12d" % (m["channels"], m["days"], m["shows"], m["seconds"], m["rss_kB"], m["peak_rss_kB"], m["decoded_bytes"] // 1024))
+        lines.append("kB per channel per day: %s" % ", ".join("%s days: %s" % (days, kb) for days, kb in sorted(six.iteritems(results["kb_per_channel_day"]), key=lambda x: int(x[0]))))
+        lines.append("Recommended max_batchsize: %s (currently %d)" % (results["max_batchsize"], config.plugins.icetv.max_batchsize.value))
+        lines.append("Results saved in %s" % getIceTVDataFile(RESULTS_FILE))
+        return "\n".join(lines)
@@ -0,0 +1,54 @@
+# kate: replace-tabs on; indent-width 4; remove-trailing-spaces all; show-tabs on; newline-at-eof on;
+# -*- coding:utf-8 -*-
+
+'''
+Copyright 2014-2021 Peter Urbanec
+
+SPDX-License-Identifier: GPL-3.0-or-later
+
+For alternate licensing options contact enigma.licensing (at) urbanec.net
+
+This file is part of IceTV Plugin for enigma2.
+
+IceTV Plugin is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+IceTV Plugin is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with IceTV Plugin.  If not, see <https://www.gnu.org/licenses/>.
+
+'''
+
+# Memory use of this process and of the system, from /proc
+
+def _readField(filename, name):
+    # The kB value of the "name:" line in filename, None if it can't
+    # be determined
+    try:
+        for ln in open(filename):
+            f = ln.split()
+            if len(f) >= 2 and f[0] == name + ":":
+                return int(f[1])
+    except (IOError, ValueError):
+        pass
+    return None
+
+def getMemAvailable():
+    # Available memory in kB, or None if it can't be determined
+    return _readField("/proc/meminfo", "MemAvailable")
+
+def getRSS():
+    # Current resident set size of this process in kB, None if it
+    # can't be determined
+    return _readField("/proc/self/status", "VmRSS")
+
+def getPeakRSS():
+    # Largest resident set size of this process so far in kB, None if
+    # it can't be determined
+    return _readField("/proc/self/status", "VmHWM")
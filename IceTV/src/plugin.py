@@ -42,26 +42,40 @@ from Components.MenuList import MenuList
 from Components.Pixmap import Pixmap
 from Components.config import getConfigListEntry, ConfigText
 from Components.Converter.genre import getGenreStringSub
+from Components.Language import language
 from Plugins.Plugin import PluginDescriptor
 from Screens.ChoiceBox import ChoiceBox
 from Screens.MessageBox import MessageBox
 from Screens.Screen import Screen
 from RecordTimer import RecordTimerEntry
 from ServiceReference import ServiceReference
-from Tools.Directories import resolveFilename, SCOPE_PLUGINS
+from Tools.Directories import resolveFilename, SCOPE_PLUGINS, SCOPE_CONFIG
 from Tools.LoadPixmap import LoadPixmap
 from calendar import timegm
 from time import strptime, gmtime, localtime, strftime, time
-from . import config, enableIceTV, disableIceTV, _
+from . import config, enableIceTV, disableIceTV, loadSyncState, saveSyncState, clearSyncState, epg_save_scheduler, \
+    getIceTVDeviceType, getIceTVDataFile, _
 from . import API as ice
-from collections import deque, defaultdict
+from .memory import getMemAvailable, getRSS
+from collections import deque, defaultdict, OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from six.moves.queue import Queue
 from operator import itemgetter
 from Screens.TextBox import TextBox
 from Components.TimerSanityCheck import TimerSanityCheck
-import NavigationInstance
 import gettext
-from twisted.internet import reactor, threads
-from os import path
+import inspect
+import json
+import struct
+import threading
+import zlib
+from hashlib import sha1
+from twisted.internet import reactor, threads, defer
+from twisted.python.failure import Failure
+from os import path, remove, rename, stat
 
 
 _session = None
@@ -385,7 +399,7 @@ def _logResponseException(logger, heading, exception):
     if isinstance(exception, RequestException):
         if isinstance(exception, ConnectionError):
             msg += ": " + _("The IceTV server can not be reached. Try checking the Internet connection on your %s %s\nError") % (getMachineBrand(), getMachineName())
-            if hasattr(exception.message, "reason") and isinstance(exception.message.reason, Exception):
+            if hasattr(getattr(exception, "message", None), "reason") and isinstance(exception.message.reason, Exception):
                 err_text = exception.message.reason.message
                 skip_start = exception.message.reason.message.find("<")
                 skip_pos = exception.message.reason.message.find(">: ")
@@ -408,31 +422,959 @@ def _logResponseException(logger, heading, exception):
     logger.addLog("%s%s" % (msg, details_text and ("\n%s" % exception_text) or ''))
     return "%s%s" % (msg, details_text)
 
-def _getBatchsize(last_update):
+def _getFetchDays(last_update):
     maxDays = {
         "AUS": 7,
         "DEU": 14,
     }.get(config.plugins.icetv.member.country.value, 14)
-    days = min(maxDays, (int(time()) - last_update + 86400 - 1) // 86400)
-    # Default batch size if it can't be determined dynamically
-    batchsize = config.plugins.icetv.max_batchsize.value
+    # At least one day, even if the server's clock is ahead of ours
+    return max(1, min(maxDays, (int(time()) - last_update + 86400 - 1) // 86400))
+
+def _acceptsKeyword(func, name):
+    # Whether func can be called with the keyword argument name
     try:
-        for ln in open("/proc/meminfo"):
-            f = ln.split()
-            # Reduce batch size on machines with < 512MiB total available memory
-            if len(f) >= 2 and f[0] == "MemAvailable:":
-                memkB = int(f[1])
-                # Allow 60MB headroom & 250kB/channel/day &
-                # clamp in the range 1 .. config.plugins.icetv.max_batchsize
-                # if max_batchsize is non-zero, otherwise just ensure
-                # batchsize > 1
-                batchsize = max(1, (memkB - 60000) // (days * 250))
-                if config.plugins.icetv.max_batchsize.value > 0:
-                    batchsize = min(batchsize, config.plugins.icetv.max_batchsize.value)
+        if six.PY2:
+            spec = inspect.getargspec(func)
+            return name in spec.args or spec.keywords is not None
+        spec = inspect.getfullargspec(func)
+        return name in spec.args or name in spec.kwonlyargs or spec.varkw is not None
+    except TypeError:
+        return False
+
+MAX_PIPELINE_DEPTH = 3
+
+class BatchSizeTuner(object):
+    # Chooses the number of channels to fetch in a batch from the
+    # available memory and the memory used per channel per day of
+    # EPG fetched, as measured for earlier batches on this type of
+    # device. Measurements are kept separately for each number of
+    # days fetched, so that update fetches don't lower the estimate
+    # for full fetches.
+    # A batch's memory use is the larger of the RSS increase once
+    # it is converted, measured when no other batches are being
+    # downloaded, and its decoded response size. A
+    # measurement above the estimate replaces it, a lower one is
+    # averaged in slowly. Batches only grow beyond the size allowed
+    # by the default estimate to twice the largest batch measured.
+
+    HEADROOM = 60000  # kB of available memory to leave unused
+    DEFAULT_KB_PER_CHANNEL_DAY = 100
+    SAFETY = 1.25  # Allow this much more than the estimated memory use
+    DECAY = 0.2  # Weight of a measurement below the estimate
+
+    def __init__(self, device_type):
+        self.device_type = str(device_type)
+        self.filename = getIceTVDataFile("batchsize.json")
+        # Number of days fetched -> {"kb_per_channel_day",
+        # "bytes_per_channel_day", "max_channels", "samples"}
+        self.estimates = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                estimates = json.load(f).get(self.device_type, {})
+            self.estimates = dict((int(days), estimate) for days, estimate in six.iteritems(estimates))
+        except (IOError, OSError):
+            pass
+        except (ValueError, AttributeError, TypeError) as ex:
+            print("[EPGFetcher] can't load batch size estimates:", ex)
+
+    def save(self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            data = {}
+        data[self.device_type] = dict((str(days), estimate) for days, estimate in six.iteritems(self.estimates))
+        try:
+            with open(self.filename + ".tmp", "w") as f:
+                json.dump(data, f, sort_keys=True)
+            rename(self.filename + ".tmp", self.filename)
+        except (IOError, OSError) as ex:
+            print("[EPGFetcher] can't save batch size estimates:", ex)
+
+    def getKbPerChannelDay(self, days):
+        estimate = self.estimates.get(days)
+        return estimate["kb_per_channel_day"] if estimate else self.DEFAULT_KB_PER_CHANNEL_DAY
+
+    def getBatchkB(self, batchsize, days):
+        return batchsize * days * self.getKbPerChannelDay(days) * self.SAFETY
+
+    def getBatchsize(self, last_update):
+        days = _getFetchDays(last_update)
+        # Default batch size if it can't be determined dynamically
+        batchsize = config.plugins.icetv.max_batchsize.value
+        memkB = getMemAvailable()
+        if memkB is not None:
+            # Clamp in the range 1 .. config.plugins.icetv.max_batchsize
+            # if max_batchsize is non-zero, otherwise just ensure
+            # batchsize > 1
+            # Shows are converted as they are streamed, so only
+            # the converted events are held in memory
+            batchsize = max(1, int((memkB - self.HEADROOM) // self.getBatchkB(1, days)))
+            estimate = self.estimates.get(days)
+            if estimate:
+                default_batchsize = int((memkB - self.HEADROOM) // (days * self.DEFAULT_KB_PER_CHANNEL_DAY * self.SAFETY))
+                batchsize = max(1, min(batchsize, max(default_batchsize, 2 * estimate["max_channels"])))
+            if config.plugins.icetv.max_batchsize.value > 0:
+                batchsize = min(batchsize, config.plugins.icetv.max_batchsize.value)
+        return batchsize
+
+    def getPipelineDepth(self, batchsize, last_update):
+        # Number of batches that can be downloading while another batch
+        # is being converted and imported. Responses are streamed, so a
+        # batch that is waiting to be converted only holds up to
+        # ice.STREAM_BUFFER_SIZE of its response before its download
+        # is paused. Each batch being downloaded needs its own
+        # persistent connection.
+        max_depth = min(MAX_PIPELINE_DEPTH, config.plugins.icetv.connection.pool_size.value - 1)
+        memkB = getMemAvailable()
+        if memkB is None or not batchsize:
+            return min(1, max_depth)
+        buffer_kB = ice.STREAM_BUFFER_SIZE * 2 / 1024.0  # Allow for data received while pausing
+        free_kB = memkB - self.HEADROOM - self.getBatchkB(batchsize, _getFetchDays(last_update))
+        return max(0, min(max_depth, int(free_kB // buffer_kB)))
+
+    def record(self, channels, last_update, decoded_bytes, rss_kB):
+        # Record the memory used by a batch of channels fetched
+        # since last_update. rss_kB is None if it couldn't be measured.
+        days = _getFetchDays(last_update)
+        channel_days = max(1, channels * days)
+        kb = max(rss_kB or 0, decoded_bytes / 1024.0) / channel_days
+        bytes_per_channel_day = decoded_bytes / channel_days
+        estimate = self.estimates.get(days)
+        if estimate is None:
+            estimate = self.estimates[days] = {"kb_per_channel_day": kb, "bytes_per_channel_day": bytes_per_channel_day, "max_channels": channels, "samples": 0}
+        elif kb > estimate["kb_per_channel_day"]:
+            estimate["kb_per_channel_day"] = kb
+        else:
+            estimate["kb_per_channel_day"] += (kb - estimate["kb_per_channel_day"]) * self.DECAY
+        estimate["bytes_per_channel_day"] += (bytes_per_channel_day - estimate["bytes_per_channel_day"]) * self.DECAY
+        estimate["max_channels"] = max(estimate.get("max_channels", 0), channels)
+        estimate["samples"] += 1
+        print("[EPGFetcher] batch of %d channels for %d days: %.0f kB per channel per day measured, %.0f kB estimated, %.0f bytes decoded per channel per day" % (channels, days, kb, estimate["kb_per_channel_day"], bytes_per_channel_day))
+
+class ChannelServiceMap(Mapping):
+    # Read-only map of IceTV channel_id to the list of DVB
+    # (onid, tsid, sid) triplets of its services, with a reverse
+    # index from triplet to channel_ids and a memo of service
+    # reference strings to channel_id.
+    # A new ChannelServiceMap is made each time the channel map is
+    # fetched, so it can be used from any thread without locking.
+
+    def __init__(self, channel_triplets=None):
+        self._channels = dict((channel_id, tuple(triplets)) for channel_id, triplets in six.iteritems(channel_triplets or {}))
+        index = defaultdict(list)
+        for channel_id, triplets in six.iteritems(self._channels):
+            for triplet in triplets:
+                index[triplet].append(channel_id)
+        self._index = dict((triplet, tuple(channel_ids)) for triplet, channel_ids in six.iteritems(index))
+        self._service_memo = {}
+
+    def __getitem__(self, channel_id):
+        # A new list, as eEPGCache.importEvents() needs a list
+        return list(self._channels[channel_id])
+
+    def __contains__(self, channel_id):
+        return channel_id in self._channels
+
+    def __iter__(self):
+        return iter(self._channels)
+
+    def __len__(self):
+        return len(self._channels)
+
+    def channelIds(self, triplet):
+        return self._index.get(triplet, ())
+
+    def serviceToChannelId(self, serviceref):
+        # The channel_id for a service reference (or its string),
+        # or None if the service isn't mapped
+        ref = str(serviceref)
+        try:
+            return self._service_memo[ref]
+        except KeyError:
+            pass
+        svc = ref.split(":")
+        channel_ids = self.channelIds((int(svc[5], 16), int(svc[4], 16), int(svc[3], 16)))
+        channel_id = channel_ids[0] if channel_ids else None
+        self._service_memo[ref] = channel_id
+        return channel_id
+
+class FetchJob(object):
+    # One or more fetch requests merged into a single fetch
+
+    def __init__(self):
+        self.send_scans = False
+        self.waiters = []
+        self.requested_at = time()
+
+    def merge(self, send_scans):
+        self.send_scans = self.send_scans or send_scans
+        d = defer.Deferred()
+        self.waiters.append(d)
+        return d
+
+class FetchScheduler(object):
+    # Runs fetch jobs one at a time in a worker thread. Fetches
+    # requested while a fetch is running are merged into a single
+    # pending job that runs after it. All methods except
+    # setProgress() run in the reactor thread.
+
+    IDLE = "idle"
+    RUNNING = "running"
+
+    def __init__(self, work):
+        self.work = work  # Called with the FetchJob in a worker thread
+        self.state = self.IDLE
+        self.running = None
+        self.pending = None
+        self.percent = 0
+        self.stage = ""
+
+    def request(self, send_scans=False):
+        # Returns a Deferred that fires with the result of the fetch
+        # that the request is merged into
+        if self.pending is None:
+            self.pending = FetchJob()
+        else:
+            print("[EPGFetcher] fetch request merged into pending fetch")
+        d = self.pending.merge(send_scans)
+        if self.running is None:
+            self.start()
+        return d
+
+    def start(self):
+        job, self.pending = self.pending, None
+        self.running = job
+        self.state = self.RUNNING
+        self.setProgress(0, _("starting"))
+        threads.deferToThread(self.work, job).addBoth(self.finished, job)
+
+    def finished(self, res, job):
+        self.running = None
+        self.state = self.IDLE
+        self.setProgress(100, "")
+        for waiter in job.waiters:
+            if isinstance(res, Failure):
+                waiter.errback(res)
+            else:
+                waiter.callback(res)
+        if self.pending is not None:
+            self.start()
+
+    def setProgress(self, percent, stage):
+        # May be called from the worker thread
+        self.percent = int(percent)
+        self.stage = stage
+
+    def getStatus(self):
+        return {
+            "state": self.state,
+            "percent": self.percent,
+            "stage": self.stage,
+            "pending": self.pending is not None,
+            "send_scans": self.pending is not None and self.pending.send_scans,
+        }
+
+    def getStatusText(self):
+        if self.state == self.IDLE:
+            return _("No sync running")
+        text = _("Sync running, %d%% done") % self.percent
+        if self.stage:
+            text += " (%s)" % self.stage
+        if self.pending is not None:
+            text += _(", another sync queued")
+        return text
+
+class TimerSyncQueue(object):
+    # Runs timer operations with the IceTV server. Operations queued
+    # with the same key (one local timer) run one after another, in
+    # the order they were queued. Operations for different keys run
+    # in parallel, at most MAX_CONCURRENT at a time. An operation is
+    # a function that returns a Deferred. Runs in the reactor thread.
+
+    MAX_CONCURRENT = 4
+
+    def __init__(self):
+        self.queues = OrderedDict()  # key: deque of (operation, args, queued_at)
+        self.active = set()
+        self.depth = 0
+        self.max_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def add(self, key, operation, *args):
+        self.queues.setdefault(key, deque()).append((operation, args, time()))
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self.runNext()
+
+    def isQueued(self, key):
+        # True if there are operations waiting or running for key
+        return key in self.queues
+
+    def runNext(self):
+        for key in list(self.queues):
+            if len(self.active) >= self.MAX_CONCURRENT:
                 break
-    except IOError:
-        pass
-    return batchsize
+            queue = self.queues.get(key)
+            if not queue or key in self.active:
+                continue
+            operation, args, queued_at = queue.popleft()
+            self.active.add(key)
+            defer.maybeDeferred(operation, *args).addBoth(self.done, key, queued_at)
+
+    def done(self, res, key, queued_at):
+        self.active.discard(key)
+        if key in self.queues and not self.queues[key]:
+            del self.queues[key]
+        self.depth -= 1
+        latency = time() - queued_at
+        self.completed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if isinstance(res, Failure):
+            self.failed += 1
+            print("[EPGFetcher] timer operation failed:", res.getErrorMessage())
+        self.runNext()
+
+    def getStats(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "completed": self.completed,
+            "failed": self.failed,
+            "mean_latency": self.total_latency / self.completed if self.completed else 0.0,
+            "max_latency": self.max_latency,
+        }
+
+class StatusOutbox(object):
+    # Collects timer status updates for FLUSH_DELAY seconds and sends
+    # them in a single bulk update. Only the latest update for each
+    # timer is kept. One bulk update is sent at a time, so a timer's
+    # updates reach the server in the order they were made. Updates
+    # that fail to send are retried with backoff, unless a newer
+    # update for the timer replaces them. Runs in the reactor thread.
+
+    FLUSH_DELAY = 2  # Seconds
+    RETRY_BACKOFF = 15  # Seconds before the first retry, doubled for each retry
+    MAX_RETRY_DELAY = 15 * 60  # Seconds
+
+    def __init__(self, put, logger):
+        self.put = put  # Called with a list of updates, returns a Deferred
+        self.logger = logger
+        self.pending = OrderedDict()  # ice_timer_id: update
+        self.sending = None
+        self.call = None
+        self.retry_count = 0
+
+    def add(self, ice_timer_id, state, message):
+        # The latest update for a timer goes after older updates for
+        # other timers
+        self.pending.pop(ice_timer_id, None)
+        self.pending[ice_timer_id] = {"id": ice_timer_id, "state": state, "message": message}
+        if self.call is None and self.sending is None:
+            self.call = reactor.callLater(self.FLUSH_DELAY, self.flush)
+
+    def flush(self):
+        self.call = None
+        if not self.pending or self.sending is not None:
+            return
+        self.sending = list(self.pending.values())
+        self.pending = OrderedDict()
+        self.put(self.sending).addCallbacks(self.sent, self.failed)
+
+    def sent(self, res):
+        self.sending = None
+        self.retry_count = 0
+        if self.pending:
+            self.call = reactor.callLater(self.FLUSH_DELAY, self.flush)
+
+    def failed(self, failure):
+        _logResponseException(self.logger, _("Can not update timer status"), failure.value)
+        response = getattr(failure.value, "response", None)
+        status_code = getattr(response, "status_code", None)
+        if status_code is not None and 400 <= status_code < 500 and status_code != 429:
+            # The server won't accept the updates if they're sent again
+            self.sent(None)
+            return
+        # Send the failed updates again ahead of any newer ones
+        pending = OrderedDict((update["id"], update) for update in self.sending if update["id"] not in self.pending)
+        pending.update(self.pending)
+        self.pending = pending
+        self.sending = None
+        delay = min(self.MAX_RETRY_DELAY, self.RETRY_BACKOFF * 2 ** self.retry_count)
+        self.retry_count += 1
+        print("[EPGFetcher] retrying %d timer status updates in %d seconds" % (len(self.pending), delay))
+        self.call = reactor.callLater(delay, self.flush)
+
+    def close(self):
+        # Stop sending, and return the updates that haven't been sent,
+        # oldest first, including any that are being sent
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+        updates = OrderedDict((update["id"], update) for update in self.sending or () if update["id"] not in self.pending)
+        updates.update(self.pending)
+        self.pending = OrderedDict()
+        self.sending = None
+        return list(updates.values())
+
+class ChannelMapBuilder(object):
+    # Makes the ChannelServiceMap from the server's channel list and
+    # the local TV service list.
+    # The service names are only read from the service list when the
+    # lamedb files change or after a scan, and the triplets for a
+    # channel are only worked out again if the channel's entry in the
+    # server's channel list changes. If neither the channel list nor
+    # the service list have changed, the previous map is returned.
+
+    TRIPLET_FIELDS = ("original_network_id", "transport_stream_id", "service_id")
+    SERVICE_FILES = ("lamedb", "lamedb5")
+
+    # The last map built is saved as: a header of MAGIC, VERSION, the
+    # crc32 of the server name, the region_id and the number of
+    # channels, then for each channel its channel_id, the number of
+    # triplets and the triplets.
+    MAGIC = b"ICMP"
+    VERSION = 1
+    HEADER = struct.Struct("<4sHIII")
+    CHANNEL = struct.Struct("<IH")
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.lock = threading.RLock()
+        self.invalidate()
+
+    def invalidate(self):
+        # Read the service list again on the next build
+        with self.lock:
+            self.clear()
+
+    def clear(self):
+        self.services_fingerprint = None
+        self.scan_name_map = None
+        self.name_map = None
+        self.channel_triplets = {}
+        self.key = None
+        self.channel_map = None
+
+    def getServicesFingerprint(self):
+        # Changes when the service list is saved, or None if there's
+        # no service list file to check
+        stats = []
+        for filename in self.SERVICE_FILES:
+            try:
+                st = stat(resolveFilename(SCOPE_CONFIG, filename))
+                stats.append((filename, st.st_mtime, st.st_size))
+            except OSError:
+                pass
+        return tuple(stats) or None
+
+    def checkServices(self):
+        fingerprint = self.getServicesFingerprint()
+        if self.scan_name_map is None or fingerprint is None or fingerprint != self.services_fingerprint:
+            self.clear()
+            self.services_fingerprint = fingerprint
+            self.scan_name_map = self.readServiceNames()
+            self.name_map = dict((n.upper(), tuple(t)) for n, t in six.iteritems(self.scan_name_map))
+
+    def readServiceNames(self):
+        name_map = defaultdict(list)
+
+        serviceHandler = eServiceCenter.getInstance()
+        servicelist = serviceHandler.list(service_types_tv_ref)
+        if servicelist is not None:
+            serviceRef = servicelist.getNext()
+            while serviceRef.valid():
+                name = six.ensure_text(ServiceReference(serviceRef).getServiceName(), "utf-8").strip()
+                name_map[name].append(tuple(serviceRef.getUnsignedData(i) for i in (3, 2, 1)))
+                serviceRef = servicelist.getNext()
+        return name_map
+
+    def getScanChanNameMap(self):
+        # Service names and their triplets from the service list
+        with self.lock:
+            self.checkServices()
+            return self.scan_name_map
+
+    def build(self, channels):
+        with self.lock:
+            self.checkServices()
+            channel_keys = [sha1(json.dumps(channel, sort_keys=True).encode("utf-8")).hexdigest() for channel in channels]
+            key = sha1("".join(channel_keys).encode("utf-8")).hexdigest()
+            if key == self.key and self.channel_map is not None:
+                return self.channel_map
+            res = {}
+            channel_triplets = {}
+            rebuilt = 0
+            for channel, channel_key in zip(channels, channel_keys):
+                triplets = self.channel_triplets.get(channel_key)
+                if triplets is None:
+                    triplets = self.channelTriplets(channel)
+                    rebuilt += 1
+                channel_triplets[channel_key] = triplets
+                if triplets:
+                    channel_id = int(channel["id"])
+                    if channel_id in res:
+                        seen = set(res[channel_id])
+                        res[channel_id] = res[channel_id] + tuple(t for t in triplets if t not in seen)
+                    else:
+                        res[channel_id] = triplets
+            print("[EPGFetcher] channel map: %d of %d channels rebuilt" % (rebuilt, len(channels)))
+            self.channel_triplets = channel_triplets
+            self.key = key
+            self.channel_map = ChannelServiceMap(res)
+            return self.channel_map
+
+    def getSavedMapFile(self):
+        return getIceTVDataFile("channelmap.bin")
+
+    def getIdentity(self):
+        return zlib.crc32(config.plugins.icetv.server.name.value.encode("utf-8")) & 0xffffffff, config.plugins.icetv.member.region_id.value
+
+    def save(self, channel_map):
+        server, region_id = self.getIdentity()
+        data = [self.HEADER.pack(self.MAGIC, self.VERSION, server, region_id, len(channel_map))]
+        for channel_id, triplets in six.iteritems(channel_map):
+            data.append(self.CHANNEL.pack(channel_id, len(triplets)))
+            data.append(struct.pack("<%dH" % (3 * len(triplets)), *(i for t in triplets for i in t)))
+        filename = self.getSavedMapFile()
+        try:
+            with open(filename + ".tmp", "wb") as f:
+                f.write(b"".join(data))
+            rename(filename + ".tmp", filename)
+        except (IOError, OSError) as ex:
+            print("[EPGFetcher] can't save channel map:", ex)
+
+    def load(self):
+        # The saved ChannelServiceMap, or None if there isn't one for
+        # this server and region
+        try:
+            with open(self.getSavedMapFile(), "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        try:
+            magic, version, server, region_id, count = self.HEADER.unpack_from(data)
+            if magic != self.MAGIC or version != self.VERSION or (server, region_id) != self.getIdentity():
+                print("[EPGFetcher] saved channel map is for a different version, server or region")
+                return None
+            res = {}
+            pos = self.HEADER.size
+            for i in range(count):
+                channel_id, n = self.CHANNEL.unpack_from(data, pos)
+                pos += self.CHANNEL.size
+                values = struct.unpack_from("<%dH" % (3 * n), data, pos)
+                pos += 2 * 3 * n
+                res[channel_id] = [values[j:j + 3] for j in range(0, len(values), 3)]
+        except struct.error as ex:
+            print("[EPGFetcher] can't load channel map:", ex)
+            return None
+        print("[EPGFetcher] loaded saved channel map with %d channels" % len(res))
+        return ChannelServiceMap(res)
+
+    def channelTriplets(self, channel):
+        # The triplets for a channel in the server's channel list: its
+        # DVB triplets, then those of services with one of its names
+        channel_id = int(channel["id"])
+        res = []
+        seen = set()
+        triplets = []
+        if "dvb_triplets" in channel:
+            triplets = channel["dvb_triplets"]
+        elif "dvbt_info" in channel:
+            triplets = channel["dvbt_info"]
+        for triplet in triplets:
+            t = tuple(int(triplet[servIdName]) for servIdName in self.TRIPLET_FIELDS)
+            for servId, servIdName in zip(t, self.TRIPLET_FIELDS):
+                if not (EPGFetcher.ID16_MIN <= servId <= EPGFetcher.ID16_MAX):
+                    self.logger.addLog("[EPGFetcher] ERROR: invalid serviceid: %s channel: %s %s" % (servId, channel_id, channel["name"]))
+                    break
+            else:
+                if t not in seen:
+                    seen.add(t)
+                    res.append(t)
+
+        names = [channel["name"].strip().upper()]
+        if "name_short" in channel:
+            name = channel["name_short"].strip().upper()
+            if name not in names:
+                names.append(name)
+        for n in channel.get("known_names", []):
+            name = n.strip().upper()
+            if name not in names:
+                names.append(name)
+
+        for name in names:
+            for t in self.name_map.get(name, ()):
+                if t not in seen:
+                    seen.add(t)
+                    res.append(t)
+        return tuple(res)
+
+class LocalTimerIndex(object):
+    # Index of the local RecordTimer entries by ice_timer_id, for
+    # timers in timer_list and in processed_timers, and by the
+    # pointer string of their record service.
+    # Kept up to date from the RecordTimer onTimerAdded, onTimerRemoved
+    # and onTimerChanged callbacks, and by update() when IceTV changes
+    # a timer's ice_timer_id.
+
+    def __init__(self, record_timer):
+        self.record_timer = record_timer
+        self.lock = threading.Lock()
+        self.rebuild()
+
+    def rebuild(self):
+        with self.lock:
+            self.timers = {}
+            self.processed = {}
+            self.record_services = {}
+            # id(entry) -> (ice_timer_id, processed, record service,
+            # service reference) as indexed
+            self.keys = {}
+            for entry in self.record_timer.processed_timers:
+                self._add(entry, True)
+            for entry in self.record_timer.timer_list:
+                self._add(entry, False)
+
+    def _add(self, entry, processed):
+        self._remove(entry)
+        ice_timer_id = getattr(entry, "ice_timer_id", None)
+        record_service = getattr(entry, "record_service", None)
+        service_key = record_service.getPtrString() if record_service else None
+        if ice_timer_id:
+            (self.processed if processed else self.timers)[ice_timer_id] = entry
+        if service_key:
+            self.record_services[service_key] = entry
+        service_ref = getattr(entry, "service_ref", None)
+        self.keys[id(entry)] = (ice_timer_id, processed, service_key, str(service_ref) if service_ref is not None else None)
+
+    def _remove(self, entry):
+        ice_timer_id, processed, service_key, service_ref = self.keys.pop(id(entry), (None, False, None, None))
+        timers = self.processed if processed else self.timers
+        if ice_timer_id and timers.get(ice_timer_id) is entry:
+            del timers[ice_timer_id]
+        if service_key and self.record_services.get(service_key) is entry:
+            del self.record_services[service_key]
+
+    def update(self, entry):
+        with self.lock:
+            self._add(entry, entry.state == entry.StateEnded)
+
+    def remove(self, entry):
+        with self.lock:
+            self._remove(entry)
+
+    def getServiceRef(self, entry):
+        # The service reference string of entry when it was last
+        # indexed, or None if it isn't in the index
+        key = self.keys.get(id(entry))
+        return key[3] if key else None
+
+    def getTimer(self, ice_timer_id):
+        # The timer in timer_list with ice_timer_id
+        return self.timers.get(ice_timer_id)
+
+    def getProcessedTimer(self, ice_timer_id):
+        # The timer in processed_timers with ice_timer_id
+        return self.processed.get(ice_timer_id)
+
+    def getRecordingTimer(self, rec_service_id):
+        # The timer recording to the record service with the
+        # pointer string rec_service_id
+        entry = self.record_services.get(rec_service_id)
+        if entry is not None and entry.record_service and entry.record_service.getPtrString() == rec_service_id:
+            return entry
+        # The record service may have been started without a
+        # timer callback since the index was updated
+        for entry in self.record_timer.timer_list:
+            if entry.record_service and entry.record_service.getPtrString() == rec_service_id:
+                self.update(entry)
+                return entry
+        return None
+
+class TimerAckCache(object):
+    # The last (state, message) that the server acknowledged for each
+    # ice_timer_id, kept between restarts, so that updates the server
+    # already has aren't sent again. All updates are sent again every
+    # FULL_RESYNC_INTERVAL in case the server's state has drifted.
+
+    VERSION = 1
+    FULL_RESYNC_INTERVAL = 24 * 60 * 60  # Seconds
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.acks = {}
+        self.resynced_at = 0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.acks = dict((ice_timer_id, tuple(ack)) for ice_timer_id, ack in six.iteritems(data["acks"]))
+                self.resynced_at = data["resynced_at"]
+        except (IOError, OSError):
+            pass
+        except (ValueError, KeyError, TypeError) as ex:
+            print("[EPGFetcher] can't load timer acknowledgements:", ex)
+
+    def save(self):
+        with self.lock:
+            data = {"version": self.VERSION, "resynced_at": self.resynced_at, "acks": self.acks}
+            try:
+                with open(self.filename + ".tmp", "w") as f:
+                    json.dump(data, f)
+                rename(self.filename + ".tmp", self.filename)
+            except (IOError, OSError) as ex:
+                print("[EPGFetcher] can't save timer acknowledgements:", ex)
+
+    def resyncDue(self):
+        return time() - self.resynced_at >= self.FULL_RESYNC_INTERVAL
+
+    def resync(self):
+        # Send everything again on the next update
+        with self.lock:
+            self.acks = {}
+            self.resynced_at = time()
+
+    def getState(self, ice_timer_id):
+        ack = self.acks.get(ice_timer_id)
+        return ack[0] if ack else None
+
+    def forget(self, ice_timer_id):
+        with self.lock:
+            self.acks.pop(ice_timer_id, None)
+
+    def prune(self, ice_timer_ids):
+        # Drop the timers the server no longer has
+        with self.lock:
+            for ice_timer_id in set(self.acks) - set(ice_timer_ids):
+                del self.acks[ice_timer_id]
+
+    def unacknowledged(self, timers):
+        # The timer updates the server hasn't acknowledged
+        return [timer for timer in timers if self.acks.get(six.ensure_str(timer["id"], "utf-8")) != (timer.get("state"), timer.get("message"))]
+
+    def acknowledge(self, timers):
+        with self.lock:
+            for timer in timers:
+                self.acks[six.ensure_str(timer["id"], "utf-8")] = (timer.get("state"), timer.get("message"))
+        self.save()
+
+class ServerStateTransaction(object):
+    # Used while applying timer changes that come from the IceTV
+    # server. Timers muted in the transaction don't have their changes
+    # sent back to the server, and timers.xml is saved once, when the
+    # outermost transaction ends, if anything has changed.
+
+    def __init__(self, record_timer):
+        self.record_timer = record_timer
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.muted = set()
+        self.dirty = False
+        # Older images' RecordTimer.record() always saves timers.xml
+        self.record_dosave = _acceptsKeyword(record_timer.record, "dosave")
+
+    def __enter__(self):
+        with self.lock:
+            self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.lock:
+            self.depth -= 1
+            if self.depth:
+                return False
+            self.muted.clear()
+            dirty, self.dirty = self.dirty, False
+        if dirty:
+            self.record_timer.saveTimer()
+        return False
+
+    def mute(self, entry):
+        # Don't send the changes made to entry in this transaction
+        self.muted.add(id(entry))
+
+    def isMuted(self, entry):
+        return id(entry) in self.muted
+
+    def changed(self):
+        self.dirty = True
+
+    def record(self, entry):
+        # Add entry to the RecordTimer, leaving timers.xml to be saved
+        # by the transaction where the image allows it. Returns the
+        # conflicts, as RecordTimer.record() does.
+        if self.record_dosave:
+            return self.record_timer.record(entry, dosave=False)
+        return self.record_timer.record(entry)
+
+    def saveTimers(self):
+        # Save timers.xml now, or at the end of the transaction
+        with self.lock:
+            if self.depth:
+                self.dirty = True
+                return
+        self.record_timer.saveTimer()
+
+class TimerUpdateQueue(list):
+    # List of IceTV timers to send back to the server, with a set of
+    # their ids
+
+    def __init__(self):
+        super(TimerUpdateQueue, self).__init__()
+        self.ids = set()
+
+    def append(self, iceTimer):
+        super(TimerUpdateQueue, self).append(iceTimer)
+        self.ids.add(six.ensure_str(iceTimer["id"], "utf-8"))
+
+class GenreResolver(object):
+    # Maps IceTV genre names and EIT genre ids to the EIT genre to use
+    # in the EPG for a country and language, or to None if the genre
+    # can't be used. Genres, including those in the genre_remaps for
+    # the country, are checked the first time they are seen.
+    # Each unusable genre name is only logged once.
+
+    def __init__(self, country_code, lang, logger):
+        self.country_code = country_code
+        self.language = lang
+        self.logger = logger
+        self.genres = {}
+        self.errors = set()
+        self.remap_table = genre_remaps.get(country_code, {})
+        self.remaps = {}
+
+    def genreName(self, eit):
+        return getGenreStringSub((eit >> 4) & 0xf, eit & 0xf, country=self.country_code)
+
+    def logError(self, message, name):
+        if name not in self.errors:
+            self.logger.addLog(message)
+            self.errors.add(name)
+
+    def getRemap(self, name):
+        # The remapped EIT genre for a genre name in genre_remaps,
+        # checked the first time it is used
+        try:
+            return self.remaps[name]
+        except KeyError:
+            pass
+        eit_remap = self.remap_table[name]
+        mapped_name = self.genreName(eit_remap)
+        if mapped_name == gettext.gettext(name):
+            self.remaps[name] = eit_remap
+        else:
+            self.remaps[name] = None
+            self.logError('[EPGFetcher] ERROR: lookup of remapped 0x%02x "%s" returned "%s"' % (eit_remap, name, mapped_name), name)
+        return self.remaps[name]
+
+    def resolve(self, name, eit_id, show):
+        # name and eit_id are the IceTV category name and eit string
+        key = (name, eit_id)
+        try:
+            return self.genres[key]
+        except KeyError:
+            pass
+        eit = int(eit_id, 0) or 0x01
+        if eit & ~0xFF:
+            self.logger.addLog("[EPGFetcher] ERROR: invalid eit genre id: %s genre name: %s show_id: %s title: %s" % (eit, name, six.ensure_str(show["id"], "utf-8"), six.ensure_str(show.get("title", ""), "utf-8")))
+            genre = None
+        elif name in self.remap_table:
+            genre = self.getRemap(name)
+        else:
+            mapped_name = self.genreName(eit)
+            # Translate the IceTV genre name because it is being
+            # compared to a translated genre name returned by
+            # getGenreStringSub()
+            # It must be translated using the main translation set,
+            # not the IceTV ones, becaiuse that's where the genre
+            # name translations are.
+            if mapped_name == gettext.gettext(name):
+                genre = eit
+            else:
+                genre = None
+                self.logError('[EPGFetcher] ERROR: lookup of 0x%02x "%s" returned \"%s"' % (eit, name, mapped_name), name)
+        self.genres[key] = genre
+        return genre
+
+class EventFingerprints(object):
+    # Fingerprints of the shows that have been imported into the EPG
+    # cache, for each channel_id by event id, with the show's start
+    # time, so that shows the server sends again unchanged aren't
+    # converted and imported again. A fingerprint is the crc32 of all
+    # the show fields that EPGFetcher.convertShow() uses, so that it
+    # stays the same after a restart, and the fingerprints are saved
+    # with the sync state. context is the (country, language) that
+    # the shows were converted for.
+
+    FIELDS = ("id", "eit_id", "title", "subtitle", "desc", "start_unix", "stop_unix", "rating", "deleted_record")
+
+    def __init__(self):
+        self.channels = {}
+        self.context = None
+
+    @classmethod
+    def fingerprint(cls, show):
+        # None if the show is a deletion or can't be fingerprinted
+        if "deleted_record" in show and int(show["deleted_record"]) == 1:
+            return None
+        try:
+            fields = [show.get(f) for f in cls.FIELDS] + [[g.get("name"), g.get("eit")] for g in show.get("category", [])]
+            return zlib.crc32(six.ensure_binary(json.dumps(fields, separators=(",", ":")))) & 0xffffffff
+        except (TypeError, ValueError, AttributeError):
+            return None
+
+    def isUnchanged(self, channel_id, event_id, start, fingerprint):
+        return fingerprint is not None and self.channels.get(channel_id, {}).get(event_id) == (start, fingerprint)
+
+    def update(self, channel_id, event_id, start, fingerprint):
+        # Record the fingerprint of a show that has been imported,
+        # or forget the event if fingerprint is None
+        if fingerprint is None:
+            self.channels.get(channel_id, {}).pop(event_id, None)
+        else:
+            self.channels.setdefault(channel_id, {})[event_id] = (start, fingerprint)
+
+    def clear(self, channel_ids=None):
+        if channel_ids is None:
+            self.channels.clear()
+        else:
+            for channel_id in channel_ids:
+                self.channels.pop(channel_id, None)
+
+    def prune(self, before):
+        # Forget shows that started before the time before, as
+        # they will have expired from the EPG cache
+        for channel_id, shows in list(six.iteritems(self.channels)):
+            for event_id in [event_id for event_id, (start, fingerprint) in six.iteritems(shows) if int(start) < before]:
+                del shows[event_id]
+            if not shows:
+                del self.channels[channel_id]
+
+    def getState(self):
+        # A copy of the fingerprints to save with the sync state
+        return {
+            "context": self.context,
+            "channels": dict((str(channel_id), [[event_id, start, fingerprint] for event_id, (start, fingerprint) in six.iteritems(shows)]) for channel_id, shows in six.iteritems(self.channels)),
+        }
+
+    def setState(self, state):
+        self.context = tuple(state["context"]) if state.get("context") else None
+        self.channels = dict((int(channel_id), dict((event_id, (start, fingerprint)) for event_id, start, fingerprint in shows)) for channel_id, shows in six.iteritems(state.get("channels", {})))
+
+    def __len__(self):
+        return sum(len(shows) for shows in six.itervalues(self.channels))
 
 class LogEntry(dict):
     def __init__(self, timestamp, log_message, sent=False):
@@ -516,22 +1458,50 @@ class EPGFetcher(object):
     ID16_MIN = 1
     ID16_MAX = 0xFFFF
     PADDING_ALLOWANCE = 24 * 60 * 60  # 1 day - must at least max allowed "after" padding
+    DELETED_START = 999  # Start time of the placeholder events that remove deleted shows from the EPG
+    PREWARM_LEAD = 10  # Seconds before a scheduled fetch to open the server connection
+    RETRY_BACKOFF = 15  # Seconds before the first retry of a failed fetch, doubled for each retry
+    SYNC_SAMPLE_SIZE = 8  # Number of imported events kept to check the EPG cache against the sync state
+    WATERMARK_GROUPING = 15 * 60  # Seconds between channel watermarks that can be fetched in the same batch
+    EDIT_DEBOUNCE = 3  # Seconds to collect changes to a timer before sending them
+    PENDING_UPDATES_VERSION = 1  # Format of the timer updates saved at shutdown
 
     def __init__(self):
         self.fetch_timer = eTimer()
         self.fetch_timer.callback.append(self.createFetchJob)
+        self.fetch_timer.callback.append(self.startPrewarmTimer)
+        self.prewarm_timer = eTimer()
+        self.prewarm_timer.callback.append(self.prewarmConnection)
+        self.retry_timer = eTimer()
+        self.retry_timer.callback.append(self.createFetchJob)
+        self.retry_count = 0
+        # Adaptive limit on the number of batches downloaded in parallel
+        self.shows_limit = ice.ConcurrencyLimit("shows", limit=config.plugins.icetv.connection.shows_concurrency.value, max_limit=MAX_PIPELINE_DEPTH + 1, on_change=self.showsLimitChanged)
+        self.batch_tuner = BatchSizeTuner(getIceTVDeviceType())
         config.plugins.icetv.refresh_interval.addNotifier(self.freqChanged, initial_call=False, immediate_feedback=False)
         self.fetch_timer.start(int(config.plugins.icetv.refresh_interval.value) * 1000)
+        self.startPrewarmTimer()
         self.log = deque(maxlen=40)
-        self.send_scans = False
-        # TODO: channel_service_map should probably be locked in case the user edits timers at the time of a fetch
-        # Then again, the GIL may actually prevent issues here.
-        self.channel_service_map = None
+        # Only one fetch runs at a time
+        self.fetch_scheduler = FetchScheduler(lambda job: self.doWork(job.send_scans))
+        # A ChannelServiceMap; replaced, never modified, when the
+        # channel map is fetched. Until then, the saved map is loaded
+        # the first time it is needed.
+        self._channel_service_map = None
+        self.channel_map_builder = ChannelMapBuilder(self)
+        self.channel_map_loaded = False
+        # Callers waiting for the channel map being fetched, or None
+        # if it isn't being fetched
+        self.channel_map_waiters = None
 
         # Status updates for timers that can't be processed at
         # the time that a status change is flagged (e.g. for instant
         # timers that don't initially have an IceTV id.
         self.deferred_status = defaultdict(list)
+        # Timer updates acknowledged by the server
+        self.timer_acks = TimerAckCache(getIceTVDataFile("timeracks.json"))
+        # Status updates waiting to be sent
+        self.status_outbox = StatusOutbox(self.putTimers, self)
 
         # Timers that have failed, but where, when the iRecordableService
         # issues its evEnd event, the iRecordableService.getError()
@@ -540,6 +1510,22 @@ class EPGFetcher(object):
 
         self.settings = {}
 
+        # Made for the country and language when first needed
+        self.genre_resolver = None
+        language.addCallback(self.languageChanged)
+
+        # The sync state is checked against the EPG cache before
+        # the first update. sync_sample maps channel_id to
+        # (service_ref, event_id, end) of an imported event.
+        self.sync_state_checked = False
+        self.sync_sample = {}
+        # Server last_update_time of the last update fetched for each
+        # channel_id
+        self.watermarks = {}
+        # Shows imported into the EPG cache since it was last cleared
+        # or loaded
+        self.event_fingerprints = EventFingerprints()
+
         # Update status for timers that are already running at startup
         # Use id(None) for their key to differentiate them from deferred
         # updates for specific timers
@@ -549,10 +1535,19 @@ class EPGFetcher(object):
             if entry.record_service and self.shouldProcessTimer(entry):
                 self.deferred_status[id(None)].append((entry, state, message, int(time())))
 
+        self.timer_index = LocalTimerIndex(_session.nav.RecordTimer)
+        # Timer changes sent to the IceTV server
+        self.timer_sync = TimerSyncQueue()
+        # Timer changes received from the IceTV server
+        self.server_state = ServerStateTransaction(_session.nav.RecordTimer)
+        # id(entry): [entry, ice_timer_id, channel changed, DelayedCall]
+        # for changes to timers waiting to be sent
+        self.timer_edits = {}
         _session.nav.RecordTimer.onTimerAdded.append(self.onTimerAdded)
         _session.nav.RecordTimer.onTimerRemoved.append(self.onTimerRemoved)
         _session.nav.RecordTimer.onTimerChanged.append(self.onTimerChanged)
         _session.nav.record_event.append(self.gotRecordEvent)
+        self.loadPendingTimerUpdates()
         self.addLog("IceTV started")
 
     def shouldProcessTimer(self, entry):
@@ -571,17 +1566,33 @@ class EPGFetcher(object):
 
     def onTimerAdded(self, entry):
         # print("[IceTV] timer added: ", entry)
-        if not self.shouldProcessTimer(entry):
+        self.timer_index.update(entry)
+        if not self.shouldProcessTimer(entry) or self.server_state.isMuted(entry):
             return
         # print("[IceTV] Add timer job")
-        reactor.callInThread(self.postTimer, entry)
+        reactor.callFromThread(self.timer_sync.add, id(entry), self.postTimer, entry)
 
     def onTimerRemoved(self, entry):
         # print("[IceTV] timer removed: ", entry)
-        if not self.shouldProcessTimer(entry) or not entry.ice_timer_id:
+        self.timer_index.remove(entry)
+        if not self.shouldProcessTimer(entry):
             return
         # print("[IceTV] Delete timer job")
-        reactor.callInThread(self.deleteTimer, entry.ice_timer_id)
+        reactor.callFromThread(self.queueDelete, entry)
+
+    def queueDelete(self, entry):
+        # Changes to the timer that haven't been sent are dropped.
+        # If the timer is still being posted, it only has an
+        # ice_timer_id once that finishes.
+        edit = self.timer_edits.pop(id(entry), None)
+        if edit is not None:
+            edit[3].cancel()
+        if entry.ice_timer_id or self.timer_sync.isQueued(id(entry)):
+            self.timer_sync.add(id(entry), self.deleteEntryTimer, entry)
+
+    def deleteEntryTimer(self, entry):
+        if entry.ice_timer_id:
+            return self.deleteTimer(entry.ice_timer_id)
 
     def onTimerChanged(self, entry):
         # print("[IceTV] timer changed: ", entry)
@@ -589,36 +1600,109 @@ class EPGFetcher(object):
         # If entry.cancelled is True, the timer is being deleted
         # and will be processed by a subsequent onTimerRemoved() call
 
-        if not self.shouldProcessTimer(entry) or entry.cancelled:
+        previous_ref = self.timer_index.getServiceRef(entry)
+        self.timer_index.update(entry)
+        if not self.shouldProcessTimer(entry) or entry.cancelled or self.server_state.isMuted(entry):
             return
         if entry.end <= entry.begin:
             self.onTimerRemoved(entry)
             return
-        if entry.ice_timer_id is None:
-            # New timer as far as IceTV is concerned
-            # print("[IceTV] Add timer job")
-            reactor.callInThread(self.postTimer, entry)
+        reactor.callFromThread(self.timerChanged, entry, self.channelChanged(previous_ref, entry))
+
+    def channelChanged(self, previous_ref, entry):
+        # True if entry may have moved to a different IceTV channel
+        # since its service reference was previously indexed
+        service_ref = str(entry.service_ref)
+        if previous_ref == service_ref:
+            return False
+        if previous_ref is None or self.channel_service_map is None:
+            return True
+        return self.channel_service_map.serviceToChannelId(previous_ref) != self.channel_service_map.serviceToChannelId(service_ref)
+
+    def timerChanged(self, entry, channel_changed):
+        # Changes to a timer that IceTV knows about are collected for
+        # EDIT_DEBOUNCE seconds and sent as a single update. The timer
+        # is only deleted and created again on the IceTV side if its
+        # channel changed.
+        edit = self.timer_edits.get(id(entry))
+        if edit is None:
+            if entry.ice_timer_id is None:
+                # New timer as far as IceTV is concerned
+                # print("[IceTV] Add timer job")
+                self.timer_sync.add(id(entry), self.postTimer, entry)
+                return
+            edit = self.timer_edits[id(entry)] = [entry, entry.ice_timer_id, False, None]
         else:
+            edit[3].cancel()
+        edit[2] = edit[2] or channel_changed
+        edit[3] = reactor.callLater(self.EDIT_DEBOUNCE, self.sendTimerEdit, id(entry))
+
+    def sendTimerEdit(self, key):
+        entry, ice_timer_id, channel_changed, call = self.timer_edits.pop(key)
+        if channel_changed:
             # print("[IceTV] Modify timer jobs")
-            ice_timer_id = entry.ice_timer_id
             entry.ice_timer_id = None
-            # Delete the timer on the IceTV side, then post the new one
-            # print("[IceTV] Modify timer jobs - delete timer job")
-            d = threads.deferToThread(lambda: self.deleteTimer(ice_timer_id))
-            d.addCallback(lambda x: self.deferredPostTimer(entry))
+            self.timer_index.update(entry)
+            self.timer_sync.add(key, self.replaceTimer, ice_timer_id, entry)
+        else:
+            self.timer_sync.add(key, self.putTimer, entry)
+
+    def savePendingTimerUpdates(self):
+        # Keep the timer status updates and edits that haven't been
+        # sent when enigma2 shuts down, so they are sent after it
+        # restarts
+        edits = {}
+        for entry, ice_timer_id, channel_changed, call in six.itervalues(self.timer_edits):
+            if call.active():
+                call.cancel()
+            edits[ice_timer_id] = channel_changed
+        self.timer_edits = {}
+        data = {"version": self.PENDING_UPDATES_VERSION, "status": self.status_outbox.close(), "edits": edits}
+        if not data["status"] and not edits:
+            return
+        filename = getIceTVDataFile("pendingtimers.json")
+        try:
+            with open(filename + ".tmp", "w") as f:
+                json.dump(data, f)
+            rename(filename + ".tmp", filename)
+        except (IOError, OSError) as ex:
+            print("[EPGFetcher] can't save pending timer updates:", ex)
+
+    def loadPendingTimerUpdates(self):
+        # Queue the updates saved by savePendingTimerUpdates(). The
+        # edited timers are found by the ice_timer_id they had when
+        # they were edited.
+        filename = getIceTVDataFile("pendingtimers.json")
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+            remove(filename)
+        except (IOError, OSError):
+            return
+        except ValueError as ex:
+            print("[EPGFetcher] can't load pending timer updates:", ex)
+            return
+        if data.get("version") != self.PENDING_UPDATES_VERSION:
+            return
+        for update in data.get("status", []):
+            self.status_outbox.add(update["id"], update["state"], update["message"])
+        for ice_timer_id, channel_changed in six.iteritems(data.get("edits", {})):
+            entry = self.timer_index.getTimer(ice_timer_id)
+            if entry is not None and id(entry) not in self.timer_edits:
+                self.timer_edits[id(entry)] = [entry, ice_timer_id, channel_changed, reactor.callLater(self.EDIT_DEBOUNCE, self.sendTimerEdit, id(entry))]
+        print("[EPGFetcher] %d timer status updates and %d timer edits pending from the last session" % (len(data.get("status", [])), len(data.get("edits", {}))))
+
+    def replaceTimer(self, ice_timer_id, entry):
+        # Delete the timer on the IceTV side, then post the new one
+        # print("[IceTV] Modify timer jobs - delete timer job")
+        return self.deleteTimer(ice_timer_id).addCallback(lambda x: self.postTimer(entry))
 
     def gotRecordEvent(self, rec_service, event):
         if event not in self.START_EVENTS and event not in self.END_EVENTS and event not in self.ERROR_EVENTS:
             return
 
-        rec_service_id = rec_service.getPtrString()
-        rec_timer = None
-        for entry in _session.nav.RecordTimer.timer_list:
-            if entry.record_service and entry.record_service.getPtrString() == rec_service_id and self.shouldProcessTimer(entry):
-                rec_timer = entry
-                break
-
-        if rec_timer:
+        rec_timer = self.timer_index.getRecordingTimer(rec_service.getPtrString())
+        if rec_timer and self.shouldProcessTimer(rec_timer):
             self.processEvent(rec_timer, event, rec_service.getError())
 
     def processEvent(self, entry, event, err):
@@ -650,7 +1734,7 @@ class EPGFetcher(object):
             if err != iRecordableService.NoError:
                 message += ": %s" % self.ERROR_CODES.get(err, _("Unknown error code"))
             if entry.ice_timer_id:
-                reactor.callInThread(self.postStatus, entry, state, message)
+                self.postStatus(entry, state, message)
             else:
                 # Timer started before IceTV timer is assigned
                 self.deferred_status[id(entry)].append((entry, state, message, int(time())))
@@ -668,20 +1752,35 @@ class EPGFetcher(object):
         doTimeouts(self.deferred_status, old24h)
         doTimeouts(self.failed, old24h)
 
-    def deferredPostTimer(self, entry):
-        # print("[IceTV] Modify timer jobs - add timer job")
-        reactor.callInThread(self.postTimer, entry)
-
     def deferredPostStatus(self, entry):
-        tid = id(entry)
-        if tid in self.deferred_status:
-            reactor.callInThread(self.postStatus, *self.deferred_status[tid].pop(0)[0:3])
-            if not self.deferred_status[tid]:
-                del self.deferred_status[tid]
+        # Queue the deferred status updates for entry (or for the
+        # timers running at startup if entry is None) that can now
+        # be sent
+        reactor.callFromThread(self.queueDeferredStatus, id(entry))
+
+    def queueDeferredStatus(self, tid):
+        for entry, state, message, t in self.deferred_status.pop(tid, []):
+            if entry.ice_timer_id:
+                self.postStatus(entry, state, message)
+            else:
+                self.deferred_status[id(entry)].append((entry, state, message, t))
 
     def freqChanged(self, refresh_interval):
         self.fetch_timer.stop()
         self.fetch_timer.start(int(refresh_interval.value) * 1000)
+        self.startPrewarmTimer()
+
+    def startPrewarmTimer(self):
+        # Single-shot timer that fires PREWARM_LEAD seconds before
+        # the next scheduled fetch. It's restarted on each fetch.
+        self.prewarm_timer.stop()
+        interval = int(config.plugins.icetv.refresh_interval.value)
+        if interval > 2 * self.PREWARM_LEAD:
+            self.prewarm_timer.start((interval - self.PREWARM_LEAD) * 1000, True)
+
+    def prewarmConnection(self):
+        if config.plugins.icetv.configured.value and config.plugins.icetv.enable_epg.value and ice.haveCredentials():
+            ice.prewarmConnection()
 
     def addLog(self, msg):
         entry = LogEntry(time(), msg)
@@ -695,10 +1794,30 @@ class EPGFetcher(object):
                 self.addLog("Can not proceed - you need to login first")
                 return
             # print("[IceTV] Create fetch job")
-            self.send_scans = self.send_scans or send_scans
-            reactor.callInThread(self.doWork)
+            self.fetch_scheduler.request(send_scans).addBoth(self.fetchDone)
+
+    def fetchDone(self, res):
+        # Runs in the reactor thread when a fetch job finishes.
+        # If the fetch failed while the server is unavailable, try
+        # again after a backoff delay rather than waiting for the
+        # next scheduled fetch.
+        self.retry_timer.stop()
+        if isinstance(res, Failure):
+            self.addLog("Error trying to fetch: %s" % res.getErrorMessage())
+            res.printTraceback()
+        if res is True or password_requested or not ice.haveCredentials():
+            self.retry_count = 0
+            return
+        interval = int(config.plugins.icetv.refresh_interval.value)
+        delay = max(ice.getRetryDelay(), self.RETRY_BACKOFF * 2 ** self.retry_count)
+        if delay < interval:
+            self.retry_count += 1
+            print("[EPGFetcher] fetch failed, retrying in %d seconds" % delay)
+            self.retry_timer.start(int(delay * 1000), True)
+        else:
+            self.retry_count = 0
 
-    def doWork(self):
+    def doWork(self, send_scans=False):
         global password_requested
         self.addLog("Start update")
         if password_requested:
@@ -712,7 +1831,7 @@ class EPGFetcher(object):
                 return False
         res = True
         try:
-            self.settings = dict((s["name"], six.ensure_text(s["value"], "utf-8") if s["type"] == 2 else s["value"]) for s in self.getSettings())
+            self.settings = dict((s["name"], six.ensure_text(s["value"], "utf-8") if s["type"] == 2 else s["value"]) for s in self.blockingCall(self.getSettings))
             print("[EPGFetcher] server settings", self.settings)
         except (Exception) as ex:
             self.settings = {}
@@ -721,22 +1840,26 @@ class EPGFetcher(object):
         print("[EPGFetcher] send_logs", send_logs)
         if send_logs:
             self.postPvrLogs()
+        self.fetch_scheduler.setProgress(5, _("fetching channels"))
         try:
-            self.channel_service_map = self.makeChanServMap(self.getChannels())
+            self.blockingCall(self.refreshChannelMap)
         except (Exception) as ex:
             _logResponseException(self, _("Can not retrieve channel map"), ex)
             if send_logs:
                 self.postPvrLogs()
             return False
-        if self.send_scans:
+        if send_scans:
+            self.fetch_scheduler.setProgress(10, _("sending scans"))
             self.postScans()
-            self.send_scans = False
+        if not self.sync_state_checked:
+            self.restoreSyncState()
         try:
             res = self.processShowsBatched()
             self.deferredPostStatus(None)
             self.statusCleanup()
             if res:  # Timers fetched in non-batched show fetch
                 self.addLog("End update")
+                self.printConnectionStats()
                 if send_logs:
                     self.postPvrLogs()
                 return res
@@ -748,8 +1871,9 @@ class EPGFetcher(object):
             else:
                 _logResponseException(self, _("Can not download EPG"), ex)
                 res = False
+        self.fetch_scheduler.setProgress(95, _("fetching timers"))
         try:
-            ice_timers = self.getTimers()
+            ice_timers = self.blockingCall(self.getTimers)
             if not self.processTimers(ice_timers):
                 res = False
         except (Exception) as ex:
@@ -760,87 +1884,133 @@ class EPGFetcher(object):
             self.addLog("No token, requesting password...")
             _session.open(IceTVNeedPassword)
         self.addLog("End update")
+        self.printConnectionStats()
         self.deferredPostStatus(None)
         self.statusCleanup()
         if send_logs:
             self.postPvrLogs()
         return res
 
+    def restoreSyncState(self):
+        # Continue from the last update saved with the EPG cache,
+        # provided the EPG cache still holds the sampled events
+        self.sync_state_checked = True
+        if config.plugins.icetv.last_update_time.value:
+            return
+        state = loadSyncState()
+        if state is None:
+            return
+        now = int(time())
+        sample = dict((channel_id, (service_ref, event_id, end)) for channel_id, service_ref, event_id, end in state["sample"] if end > now)
+        if not sample:
+            print("[EPGFetcher] no current events to check the sync state against")
+            return
+        epgcache = eEPGCache.getInstance()
+        for service_ref, event_id, end in six.itervalues(sample):
+            if epgcache.lookupEventId(eServiceReference(str(service_ref)), event_id) is None:
+                self.addLog("EPG cache does not match saved state, downloading full EPG")
+                clearSyncState()
+                return
+        config.plugins.icetv.last_update_time.value = state["last_update_time"]
+        self.watermarks = dict((int(channel_id), watermark) for channel_id, watermark in six.iteritems(state["watermarks"]))
+        self.sync_sample = sample
+        self.event_fingerprints.setState(state["fingerprints"])
+        self.addLog("Continuing EPG updates from %s" % strftime("%Y-%m-%d %H:%M:%S", localtime(state["last_update_time"])))
+
+    def updateSyncSample(self, channel_id, events):
+        # Keep the imported event that will stay in the EPG cache
+        # longest for each channel, and the channels with the latest
+        # of those events. Deletions aren't kept in the EPG cache, so
+        # if there are only deletions, the previous sample is kept.
+        events = [event for event in events if event[0] != self.DELETED_START]
+        if not events:
+            return
+        triplet = self.channel_service_map[channel_id][0]
+        event = max(events, key=itemgetter(0))
+        self.sync_sample[channel_id] = ("1:0:1:%X:%X:%X:0:0:0:0:" % (triplet[2], triplet[1], triplet[0]), event[6], event[0] + event[1])
+        if len(self.sync_sample) > self.SYNC_SAMPLE_SIZE:
+            del self.sync_sample[min(self.sync_sample, key=lambda ch: self.sync_sample[ch][2])]
+
+    def getSyncState(self, last_update_time):
+        # A function that saves the current sync state, for when the
+        # EPG cache is saved
+        now = int(time())
+        watermarks = dict(self.watermarks)
+        sample = [[channel_id] + list(sample) for channel_id, sample in six.iteritems(self.sync_sample) if sample[2] > now]
+        fingerprints = self.event_fingerprints.getState()
+        return lambda saved_at: saveSyncState(last_update_time, watermarks, sample, fingerprints, saved_at)
+
+    def printConnectionStats(self):
+        stats = ice.getConnectionStats()
+        print("[EPGFetcher] connections: %d requests, %d new, %d reused" % (stats["requests"], stats["new_connections"], stats["reused_connections"]))
+        stats = self.timer_sync.getStats()
+        print("[EPGFetcher] timer operations: %d done, %d failed, %d queued (at most %d), latency %.2fs mean, %.2fs max" % (
+            stats["completed"], stats["failed"], stats["depth"], stats["max_depth"], stats["mean_latency"], stats["max_latency"]))
+
     def getTriplets(self):
         name_map = self.getScanChanNameMap()
         if not self.channel_service_map or not name_map:
             return None
 
-        triplet_map = defaultdict(list)
         scan_list = []
 
-        for channel_id, triplets in six.iteritems(self.channel_service_map):
-            for triplet in triplets:
-                triplet_map[triplet].append(channel_id)
         for name, triplets in six.iteritems(name_map):
             for triplet in triplets:
-                if triplet in triplet_map:
-                    for channel_id in triplet_map[triplet]:
+                channel_ids = self.channel_service_map.channelIds(triplet)
+                if channel_ids:
+                    for channel_id in channel_ids:
                         scan_list.append({"channel_id": channel_id, "channel_name": name, "sid": triplet[2], "tsid": triplet[1], "onid": triplet[0]})
                 else:
                     scan_list.append({"channel_name": name, "sid": triplet[2], "tsid": triplet[1], "onid": triplet[0]})
         return scan_list or None
 
-    def getScanChanNameMap(self):
-        name_map = defaultdict(list)
+    @property
+    def channel_service_map(self):
+        if self._channel_service_map is None and not self.channel_map_loaded:
+            self.channel_map_loaded = True
+            self._channel_service_map = self.channel_map_builder.load()
+        return self._channel_service_map
+
+    @channel_service_map.setter
+    def channel_service_map(self, channel_map):
+        self._channel_service_map = channel_map
+
+    def refreshChannelMap(self):
+        # Fetch the channel list and make the channel map from it.
+        # Runs in the reactor thread. If the channel map is already
+        # being fetched, wait for that instead of fetching it again.
+        d = defer.Deferred()
+        if self.channel_map_waiters is not None:
+            self.channel_map_waiters.append(d)
+            return d
+        self.channel_map_waiters = [d]
+
+        def done(res):
+            waiters, self.channel_map_waiters = self.channel_map_waiters, None
+            for waiter in waiters:
+                if isinstance(res, Failure):
+                    waiter.errback(res)
+                else:
+                    waiter.callback(res)
 
-        serviceHandler = eServiceCenter.getInstance()
-        servicelist = serviceHandler.list(service_types_tv_ref)
-        if servicelist is not None:
-            serviceRef = servicelist.getNext()
-            while serviceRef.valid():
-                name = six.ensure_text(ServiceReference(serviceRef).getServiceName(), "utf-8").strip()
-                name_map[name].append(tuple(serviceRef.getUnsignedData(i) for i in (3, 2, 1)))
-                serviceRef = servicelist.getNext()
-        return name_map
+        self.getChannels().addCallback(lambda channels: threads.deferToThread(self.buildChannelMap, channels)).addBoth(done)
+        return d
 
-    def makeChanServMap(self, channels):
-        tripletEntryNames = ("original_network_id", "transport_stream_id", "service_id")
-        res = defaultdict(list)
-        name_map = dict((n.upper(), t) for n, t in six.iteritems(self.getScanChanNameMap()))
+    def buildChannelMap(self, channels):
+        channel_map = self.makeChanServMap(channels)
+        if channel_map is not self._channel_service_map:
+            self.channel_map_builder.save(channel_map)
+        self.channel_service_map = channel_map
+        return channel_map
 
-        for channel in channels:
-            channel_id = int(channel["id"])
-            triplets = []
-            if "dvb_triplets" in channel:
-                triplets = channel["dvb_triplets"]
-            elif "dvbt_info" in channel:
-                triplets = channel["dvbt_info"]
-            for triplet in triplets:
-                t = tuple(int(triplet[servIdName]) for servIdName in tripletEntryNames)
-                for servId, servIdName in zip(t, tripletEntryNames):
-                    if not (self.ID16_MIN <= servId <= self.ID16_MAX):
-                        self.addLog("[EPGFetcher] ERROR: invalid serviceid: %s channel: %s %s" % (servId, channel_id, channel["name"]))
-                        break
-                else:
-                    res[channel_id].append(t)
-
-            names = [channel["name"].strip().upper()]
-            if "name_short" in channel:
-                name = channel["name_short"].strip().upper()
-                if name not in names:
-                    names.append(name)
-            for n in channel.get("known_names", []):
-                name = n.strip().upper()
-                if name not in names:
-                    names.append(name)
-
-            for triplets in (name_map[n] for n in names if n in name_map):
-                for triplet in (t for t in triplets if t not in res[channel_id]):
-                    res[channel_id].append(triplet)
-        return res
+    def getScanChanNameMap(self):
+        return self.channel_map_builder.getScanChanNameMap()
+
+    def makeChanServMap(self, channels):
+        return self.channel_map_builder.build(channels)
 
     def serviceToIceChannelId(self, serviceref):
-        svc = str(serviceref).split(":")
-        triplet = (int(svc[5], 16), int(svc[4], 16), int(svc[3], 16))
-        for channel_id, dvbt in six.iteritems(self.channel_service_map):
-            if triplet in dvbt:
-                return channel_id
+        return self.channel_service_map.serviceToChannelId(serviceref)
 
     def makeChanShowMap(self, shows):
         res = defaultdict(list)
@@ -849,63 +2019,67 @@ class EPGFetcher(object):
             res[channel_id].append(show)
         return res
 
-    def convertChanShows(self, shows, mapping_errors):
+    def getGenreResolver(self):
+        # The genre resolver for the current country and language
         country_code = config.plugins.icetv.member.country.value
+        lang = language.getLanguage()
+        resolver = self.genre_resolver
+        if resolver is None or resolver.country_code != country_code or resolver.language != lang:
+            resolver = self.genre_resolver = GenreResolver(country_code, lang, self)
+        if self.event_fingerprints.context != (country_code, lang):
+            # Shows may convert differently with the new resolver
+            self.event_fingerprints.clear()
+            self.event_fingerprints.context = (country_code, lang)
+        return resolver
+
+    def languageChanged(self):
+        self.genre_resolver = None
+
+    def convertChanShows(self, shows):
+        genre_resolver = self.getGenreResolver()
         res = []
-        category_cache = {}
         for show in shows:
-            event_id = int(show.get("eit_id", -1))
-            if not (self.ID16_MIN <= event_id <= self.ID16_MAX):
-                event_id = ice.showIdToEventId(show["id"])
-            title = six.ensure_str(show.get("title", ""), "utf-8")
-            short = six.ensure_str(show.get("subtitle", ""), "utf-8")
-            extended = six.ensure_str(show.get("desc", ""), "utf-8")
-            if "deleted_record" in show and int(show["deleted_record"]) == 1:
-                start = 999
-                duration = 10
-            else:
-                start = int(show["start_unix"])
-                stop = int(show["stop_unix"])
-                duration = stop - start
-                timeError = False
-                for which, t in ("start", start), ("stop", stop):
-                    if not (self.TIME_MIN <= t <= self.TIME_MAX):
-                        self.addLog("[EPGFetcher] ERROR: invalid EPG %s time: %d event id: %s title: %s" % (which, t, six.ensure_str(show["id"], "utf-8"), title))
-                        timeError = True
-                if not (0 < duration <= self.DURATION_MAX):
-                    self.addLog("[EPGFetcher] ERROR: invalid EPG duration: %d start time: %d event id: %s title: %s" % (duration, start, six.ensure_str(show["id"], "utf-8"), title))
-                    timeError = True
-                if timeError:
-                    continue
-            genres = []
-            for g in show.get("category", []):
-                name = six.ensure_str(g['name'], "utf-8")
-                if name in category_cache:
-                    eit_remap = category_cache[name]
-                    genres.append(eit_remap)
-                else:
-                    eit = int(g.get("eit", "0"), 0) or 0x01
-                    if eit & ~0xFF:
-                        self.addLog("[EPGFetcher] ERROR: invalid eit genre id: %s genre name: %s show_id: %s title: %s" % (eit, name, six.ensure_str(show["id"], "utf-8"), title))
-                        continue
-                    eit_remap = genre_remaps.get(country_code, {}).get(name, eit)
-                    mapped_name = getGenreStringSub((eit_remap >> 4) & 0xf, eit_remap & 0xf, country=country_code)
-                    # Translate the IceTV genre name because it is being
-                    # compared to a translated genre name returned by
-                    # getGenreStringSub()
-                    # It must be translated using the main translation set,
-                    # not the IceTV ones, becaiuse that's where the genre
-                    # name translations are.
-                    if mapped_name == gettext.gettext(name):
-                        genres.append(eit_remap)
-                        category_cache[name] = eit_remap
-                    elif name not in mapping_errors:
-                        self.addLog('[EPGFetcher] ERROR: lookup of 0x%02x%s "%s" returned \"%s"' % (eit, (" (remapped to 0x%02x)" % eit_remap) if eit != eit_remap else "", name, mapped_name))
-                        mapping_errors.add(name)
-            p_rating = ((country_code, parental_ratings.get(six.ensure_str(show.get("rating", ""), "utf-8"), 0x00)),)
-            res.append((start, duration, title, short, extended, genres, event_id, p_rating))
+            event = self.convertShow(show, genre_resolver)
+            if event is not None:
+                res.append(event)
         return res
 
+    def showEventId(self, show):
+        event_id = int(show.get("eit_id", -1))
+        if not (self.ID16_MIN <= event_id <= self.ID16_MAX):
+            event_id = ice.showIdToEventId(show["id"])
+        return event_id
+
+    def convertShow(self, show, genre_resolver):
+        event_id = self.showEventId(show)
+        title = six.ensure_str(show.get("title", ""), "utf-8")
+        short = six.ensure_str(show.get("subtitle", ""), "utf-8")
+        extended = six.ensure_str(show.get("desc", ""), "utf-8")
+        if "deleted_record" in show and int(show["deleted_record"]) == 1:
+            start = self.DELETED_START
+            duration = 10
+        else:
+            start = int(show["start_unix"])
+            stop = int(show["stop_unix"])
+            duration = stop - start
+            timeError = False
+            for which, t in ("start", start), ("stop", stop):
+                if not (self.TIME_MIN <= t <= self.TIME_MAX):
+                    self.addLog("[EPGFetcher] ERROR: invalid EPG %s time: %d event id: %s title: %s" % (which, t, six.ensure_str(show["id"], "utf-8"), title))
+                    timeError = True
+            if not (0 < duration <= self.DURATION_MAX):
+                self.addLog("[EPGFetcher] ERROR: invalid EPG duration: %d start time: %d event id: %s title: %s" % (duration, start, six.ensure_str(show["id"], "utf-8"), title))
+                timeError = True
+            if timeError:
+                return None
+        genres = []
+        for g in show.get("category", []):
+            genre = genre_resolver.resolve(six.ensure_str(g['name'], "utf-8"), g.get("eit", "0"), show)
+            if genre is not None:
+                genres.append(genre)
+        p_rating = ((genre_resolver.country_code, parental_ratings.get(six.ensure_str(show.get("rating", ""), "utf-8"), 0x00)),)
+        return (start, duration, title, short, extended, genres, event_id, p_rating)
+
     def updateDescriptions(self, showMap):
 
         # Emulate what the XML parser does to CR and LF in attributes
@@ -938,40 +2112,238 @@ class EPGFetcher(object):
                     updated |= timer_updated
         return updated
 
+    def showsLimitChanged(self, limit):
+        config.plugins.icetv.connection.shows_concurrency.value = limit
+        config.plugins.icetv.connection.shows_concurrency.save()
+
+    def startShowsFetch(self, chan_list, fetch_timers, last_update):
+        # Start downloading a batch of shows from a worker thread.
+        # The download must have been allowed by self.shows_limit.
+        # Returns a queue that receives the ShowsStream (or the Failure)
+        # and the time until the response headers arrived. The
+        # queue's cancel() cancels the download if it hasn't started
+        # receiving the response.
+        # The download's slot in self.shows_limit is held until its
+        # ShowsStream has been read to the end or closed.
+        result = Queue(1)
+        start = time()
+        channels = len(chan_list) if chan_list else len(self.channel_service_map)
+        deferreds = []
+
+        def done(res):
+            if isinstance(res, ice.ShowsStream):
+                res.on_close.append(finished)
+            else:
+                self.shows_limit.release(None)
+            result.put((res, time() - start))
+
+        def finished(completed):
+            # Compare latencies per channel, batches can differ in size
+            self.shows_limit.release((time() - start) / max(1, channels) if completed else None)
+
+        def fetch():
+            deferreds.append(self.getShows(chan_list=chan_list, fetch_timers=fetch_timers, last_update=last_update).addBoth(done))
+
+        def cancel():
+            # Runs in the reactor thread, after fetch()
+            deferreds[0].cancel()
+
+        reactor.callFromThread(fetch)
+        result.cancel = lambda: reactor.callFromThread(cancel)
+        return result
+
+    def makeShowsBatches(self):
+        # Group the channels whose watermarks are within
+        # WATERMARK_GROUPING of each other, and split each group into
+        # batches sized for the oldest watermark in the group.
+        # Returns a list of (chan_list, last_update), where chan_list
+        # is None if the only batch has all the channels.
+        channels = sorted(self.channel_service_map, key=lambda channel_id: self.watermarks.get(channel_id, 0))
+        groups = []
+        for channel_id in channels:
+            watermark = self.watermarks.get(channel_id, 0)
+            if groups and watermark - groups[-1][0] <= self.WATERMARK_GROUPING:
+                groups[-1][1].append(channel_id)
+            else:
+                groups.append((watermark, [channel_id]))
+        batches = []
+        for last_update, group in groups:
+            # Maximum number of channels to fetch in a batch
+            max_fetch = self.batch_tuner.getBatchsize(last_update) or len(group)
+            for pos in range(0, len(group), max_fetch):
+                batches.append((group[pos:pos + max_fetch], last_update))
+        if len(batches) == 1:
+            batches = [(None, batches[0][1])]
+        return batches
+
+    def saveEPG(self, changes):
+        # Schedule a save of the EPG cache for the changes made to it,
+        # and the sync state for it. last_update_time is kept as the
+        # oldest watermark of the channels that have been fetched.
+        for channel_id in list(self.watermarks):
+            if channel_id not in self.channel_service_map:
+                del self.watermarks[channel_id]
+        last_update_time = min([w for w in six.itervalues(self.watermarks) if w] or [0])
+        config.plugins.icetv.last_update_time.value = last_update_time
+        epg_save_scheduler.changed(changes, self.getSyncState(last_update_time))
+
     def processShowsBatched(self):
-        # Maximum number of channels to fetch in a batch
-        max_fetch = _getBatchsize(config.plugins.icetv.last_update_time.value)
-        print("[EPGFetcher] fetch batch size:", max_fetch)
+        # Each channel is fetched from its own watermark, so that
+        # after a failed batch only the channels in that batch need
+        # to be fetched again.
+        if not config.plugins.icetv.last_update_time.value:
+            self.watermarks.clear()
+            self.event_fingerprints.clear()
+        self.event_fingerprints.prune(int(time()) - self.DURATION_MAX)
         res = False
         channels = list(six.iterkeys(self.channel_service_map))
+        batches = self.makeShowsBatches()
+        # Maximum number of batches to download ahead of the batch
+        # being imported. Within that, the number of downloads in
+        # progress is set by self.shows_limit. The first batch is
+        # from the oldest watermark, so it is one of the largest.
+        if batches:
+            depth = self.batch_tuner.getPipelineDepth(len(batches[0][0] or channels), batches[0][1])
+            print("[EPGFetcher] fetching %d channels in %d batches, pipeline depth: %d, concurrency limit: %d" % (len(channels), len(batches), depth, self.shows_limit.getLimit()))
         epgcache = eEPGCache.getInstance()
-        channel_show_map = {}
-        last_update_time = 0
-        pos = 0
-        mapping_errors = set()
+        genre_resolver = self.getGenreResolver()
         shows = None
-        while pos < len(channels):
-            fetch_chans = channels[pos:pos + max_fetch]
-            batch_fetch = max_fetch and len(fetch_chans) != len(channels)
-            shows = self.getShows(chan_list=batch_fetch and fetch_chans or None, fetch_timers=pos + len(fetch_chans) >= len(channels))
-            channel_show_map = self.makeChanShowMap(shows["shows"])
-            for channel_id in six.iterkeys(channel_show_map):
-                if channel_id in self.channel_service_map:
-                    epgcache.importEvents(self.channel_service_map[channel_id], self.convertChanShows(channel_show_map[channel_id], mapping_errors))
-            if pos == 0 and "last_update_time" in shows:
-                last_update_time = shows["last_update_time"]
-            if self.updateDescriptions(channel_show_map):
-                NavigationInstance.instance.RecordTimer.saveTimer()
-            pos += len(fetch_chans) if max_fetch else len(channels)
-        if shows is not None and "timers" in shows:
-            res = self.processTimers(shows["timers"])
-        config.plugins.icetv.last_update_time.value = last_update_time
-        epgcache.save()
+        in_flight = deque()
+        next_batch = 0
+        imported = 0
+        changes = 0
+        descriptions_changed = False
+        totals = defaultdict(float)
+        start_time = time()
+        try:
+            for batch_num, (chan_list, last_update) in enumerate(batches):
+                while next_batch < len(batches) and len(in_flight) <= depth and self.shows_limit.acquire(force=not in_flight):
+                    in_flight.append(self.startShowsFetch(batches[next_batch][0], next_batch == len(batches) - 1, batches[next_batch][1]))
+                    next_batch += 1
+                self.fetch_scheduler.setProgress(15 + 80 * batch_num // len(batches), _("EPG batch %d of %d") % (batch_num + 1, len(batches)))
+                timings = {}
+                t = time()
+                shows, timings["download"] = in_flight.popleft().get()
+                timings["wait"] = time() - t
+                if isinstance(shows, Failure):
+                    ex = shows.value
+                    if hasattr(ex, "response") and hasattr(ex.response, "status_code") and ex.response.status_code == 404:
+                        # Ignore 404s when there are no EPG updates - buggy server
+                        print("[EPGFetcher] batch %d/%d: no EPG updates" % (batch_num + 1, len(batches)))
+                        shows = None
+                        continue
+                    shows.raiseException()
+                # Convert the shows as they are decoded, so only the
+                # converted events for the batch are held in memory
+                # Shows that are unchanged since they were imported
+                # are skipped.
+                t = time()
+                # The RSS only measures this batch if no other batches
+                # are being downloaded at the same time
+                measure_rss = not in_flight
+                rss_before = getRSS() if measure_rss else None
+                if not last_update:
+                    # Full fetch for these channels
+                    self.event_fingerprints.clear(chan_list or channels)
+                channel_event_map = defaultdict(list)
+                fingerprints = []
+                unchanged = 0
+                for show in shows:
+                    channel_id = int(show["channel_id"])
+                    if channel_id in self.channel_service_map:
+                        event_id = self.showEventId(show)
+                        start = show.get("start_unix")
+                        fingerprint = EventFingerprints.fingerprint(show)
+                        if self.event_fingerprints.isUnchanged(channel_id, event_id, start, fingerprint):
+                            unchanged += 1
+                            continue
+                        fingerprints.append((channel_id, event_id, start, fingerprint))
+                        event = self.convertShow(show, genre_resolver)
+                        if event is not None:
+                            channel_event_map[channel_id].append(event)
+                # The time the stream spent waiting for the body is
+                # part of the download, not the conversion
+                timings["convert"] = time() - t - shows.read_time
+                timings["download"] += shows.read_time
+                # The converted events for the batch are all in memory
+                rss = getRSS() if measure_rss else None
+                if rss_before is not None and rss is not None:
+                    self.batch_tuner.record(len(chan_list or channels), last_update, shows.decoded_bytes, rss - rss_before)
+                else:
+                    self.batch_tuner.record(len(chan_list or channels), last_update, shows.decoded_bytes, None)
+                t = time()
+                for channel_id, events in six.iteritems(channel_event_map):
+                    epgcache.importEvents(self.channel_service_map[channel_id], events)
+                    self.updateSyncSample(channel_id, events)
+                    changes += len(events)
+                for channel_id, event_id, start, fingerprint in fingerprints:
+                    self.event_fingerprints.update(channel_id, event_id, start, fingerprint)
+                del fingerprints
+                timings["import"] = time() - t
+                # The batch is complete, advance its channels' watermarks
+                if shows.last_update_time is not None:
+                    for channel_id in chan_list or channels:
+                        self.watermarks[channel_id] = shows.last_update_time
+                imported += 1
+                t = time()
+                if self.updateDescriptions(channel_event_map):
+                    descriptions_changed = True
+                timings["descriptions"] = time() - t
+                print("[EPGFetcher] batch %d/%d: %d channels since %d, %d shows unchanged, %d bytes on the wire, %d bytes decoded; download %.2fs (waited %.2fs), convert %.2fs, import %.2fs, descriptions %.2fs" % (
+                    batch_num + 1, len(batches), len(chan_list or channels), last_update, unchanged, shows.wire_bytes, shows.decoded_bytes,
+                    timings["download"], timings["wait"], timings["convert"], timings["import"], timings["descriptions"]))
+                for stage, seconds in six.iteritems(timings):
+                    totals[stage] += seconds
+        except Exception:
+            if imported:
+                # Keep the batches that were imported
+                self.saveEPG(changes)
+                self.batch_tuner.save()
+            if descriptions_changed:
+                self.server_state.saveTimers()
+            raise
+        finally:
+            # After a failed batch, stop the downloads of the batches
+            # after it. Cancelling or closing a download releases its
+            # slot in self.shows_limit.
+            while in_flight:
+                pending = in_flight.popleft()
+                pending.cancel()
+                res = pending.get()[0]
+                if isinstance(res, ice.ShowsStream):
+                    res.close()
+        if imported:
+            self.batch_tuner.save()
+        # Save timers.xml once for all the batches' description changes
+        if descriptions_changed:
+            self.server_state.saveTimers()
+        if batches:
+            print("[EPGFetcher] %d batches in %.2fs: download %.2fs (waited %.2fs), convert %.2fs, import %.2fs, descriptions %.2fs" % (
+                len(batches), time() - start_time, totals["download"], totals["wait"], totals["convert"], totals["import"], totals["descriptions"]))
+        if shows is not None and shows.timers is not None:
+            self.fetch_scheduler.setProgress(95, _("updating timers"))
+            res = self.processTimers(shows.timers)
+        self.saveEPG(changes)
         self.addLog("EPG download OK")
         return res
 
     def processTimers(self, timers):
-        update_queue = []
+        # Timer changes that come from the server are applied in one
+        # transaction, so they aren't sent back, and timers.xml is
+        # only written once
+        with self.server_state:
+            return self.applyServerTimers(timers)
+
+    def applyServerTimers(self, timers):
+        update_queue = TimerUpdateQueue()
+        # The state of each timer on the server, before it is updated
+        server_states = {}
+        for iceTimer in timers:
+            if "id" in iceTimer:
+                server_states[six.ensure_str(iceTimer["id"], "utf-8")] = six.ensure_str(iceTimer.get("state", ""), "utf-8")
+        # Make sure the index matches the timer lists before using it
+        # to match the server's timers
+        self.timer_index.rebuild()
         for iceTimer in timers:
             # print("[IceTV] iceTimer:", iceTimer)
             try:
@@ -996,43 +2368,43 @@ class EPGFetcher(object):
                     update_queue.append(iceTimer)
                     continue
                 if action == "forget":
-                    for timer in _session.nav.RecordTimer.timer_list:
-                        if timer.ice_timer_id == ice_timer_id:
-                            # print("[IceTV] removing timer:", timer)
-                            _session.nav.RecordTimer.removeEntry(timer)
-                            break
+                    timer = self.timer_index.getTimer(ice_timer_id)
+                    if timer is not None:
+                        # print("[IceTV] removing timer:", timer)
+                        _session.nav.RecordTimer.removeEntry(timer)
                     else:
-                        self.deleteTimer(ice_timer_id)
+                        reactor.callFromThread(self.timer_sync.add, ice_timer_id, self.deleteTimer, ice_timer_id)
                 elif state == "completed":
                     continue    # Completely ignore completed timers - the server should not be sending those back to us anyway.
                 elif channel_id in self.channel_service_map:
                     completed = False
-                    for timer in _session.nav.RecordTimer.processed_timers:
-                        if timer.ice_timer_id == ice_timer_id:
-                            # print("[IceTV] completed timer:", timer)
-                            iceTimer["state"] = "completed"
-                            iceTimer["message"] = "Done"
-                            update_queue.append(iceTimer)
-                            completed = True
+                    if self.timer_index.getProcessedTimer(ice_timer_id) is not None:
+                        # print("[IceTV] completed timer:", timer)
+                        iceTimer["state"] = "completed"
+                        iceTimer["message"] = "Done"
+                        update_queue.append(iceTimer)
+                        completed = True
                     updated = False
                     if not completed:
-                        for timer in _session.nav.RecordTimer.timer_list:
-                            if timer.ice_timer_id == ice_timer_id:
-                                # print("[IceTV] updating timer:", timer)
-                                eit = int(iceTimer.get("eit_id", -1))
-                                if not (self.ID16_MIN <= eit <= self.ID16_MAX):
-                                    eit = None
-                                if self.updateTimer(timer, name, start - config.recording.margin_before.value * 60, start + duration + config.recording.margin_after.value * 60, eit, self.channel_service_map[channel_id]):
-                                    if not self.modifyTimer(timer):
-                                        iceTimer["state"] = "failed"
-                                        iceTimer["message"] = "Failed to update timer '%s'" % name
-                                        update_queue.append(iceTimer)
-                                        self.addLog("Failed to update timer '%s" % name)
-                                else:
-                                    iceTimer["state"] = "pending"
-                                    iceTimer["message"] = "Timer already up to date '%s'" % name
+                        timer = self.timer_index.getTimer(ice_timer_id)
+                        if timer is not None:
+                            # print("[IceTV] updating timer:", timer)
+                            eit = int(iceTimer.get("eit_id", -1))
+                            if not (self.ID16_MIN <= eit <= self.ID16_MAX):
+                                eit = None
+                            self.server_state.mute(timer)
+                            if self.updateTimer(timer, name, start - config.recording.margin_before.value * 60, start + duration + config.recording.margin_after.value * 60, eit, self.channel_service_map[channel_id]):
+                                self.server_state.changed()
+                                if not self.modifyTimer(timer):
+                                    iceTimer["state"] = "failed"
+                                    iceTimer["message"] = "Failed to update timer '%s'" % name
                                     update_queue.append(iceTimer)
-                                updated = True
+                                    self.addLog("Failed to update timer '%s" % name)
+                            else:
+                                iceTimer["state"] = "pending"
+                                iceTimer["message"] = "Timer already up to date '%s'" % name
+                                update_queue.append(iceTimer)
+                            updated = True
                     created = False
                     if not completed and not updated:
                         channels = self.channel_service_map[channel_id]
@@ -1050,10 +2422,13 @@ class EPGFetcher(object):
                                 if not (self.ID16_MIN <= eit <= self.ID16_MAX):
                                     eit = None
                                 recording = RecordTimerEntry(serviceref, start - config.recording.margin_before.value * 60, start + duration + config.recording.margin_after.value * 60, name, "", eit, ice_timer_id=ice_timer_id)
-                                conflicts = _session.nav.RecordTimer.record(recording)
+                                self.server_state.mute(recording)
+                                conflicts = self.server_state.record(recording)
                                 if conflicts is None:
+                                    self.server_state.changed()
                                     iceTimer["state"] = "pending"
                                     iceTimer["message"] = "Added"
+                                    update_queue.append(iceTimer)
                                     created = True
                                     break
                                 else:
@@ -1071,10 +2446,21 @@ class EPGFetcher(object):
                     update_queue.append(iceTimer)
             except (IOError, RuntimeError, KeyError) as ex:
                 print("[IceTV] Can not process iceTimer:", ex)
-        # Send back updated timer states
+        # Send back updated timer states, leaving out those the
+        # server has already acknowledged, unless a full resync is due.
+        # If the server's state for a timer isn't the acknowledged
+        # state, the update is sent again.
+        if self.timer_acks.resyncDue():
+            self.timer_acks.resync()
+        else:
+            for iceTimer in update_queue:
+                ice_timer_id = six.ensure_str(iceTimer["id"], "utf-8")
+                if server_states.get(ice_timer_id) != self.timer_acks.getState(ice_timer_id):
+                    self.timer_acks.forget(ice_timer_id)
+        self.timer_acks.prune(server_states)
         res = True
         try:
-            self.putTimers(update_queue)
+            self.blockingCall(self.putTimers, list(update_queue))
             self.addLog("Timers updated OK")
         except KeyError as ex:
             print("[IceTV] ", str(ex))
@@ -1086,6 +2472,8 @@ class EPGFetcher(object):
 
     def isIceTimerInUpdateQueue(self, iceTimer, update_queue):
         ice_timer_id = six.ensure_str(iceTimer["id"], "utf-8")
+        if isinstance(update_queue, TimerUpdateQueue):
+            return ice_timer_id in update_queue.ids
         for timer in update_queue:
             if ice_timer_id == six.ensure_str(timer["id"], "utf-8"):
                 return True
@@ -1093,14 +2481,9 @@ class EPGFetcher(object):
 
     def isIceTimerInLocalTimerList(self, iceTimer, ignoreCompleted=False):
         ice_timer_id = six.ensure_str(iceTimer["id"], "utf-8")
-        for timer in _session.nav.RecordTimer.timer_list:
-            if timer.ice_timer_id == ice_timer_id:
-                return True
-        if not ignoreCompleted:
-            for timer in _session.nav.RecordTimer.processed_timers:
-                if timer.ice_timer_id == ice_timer_id:
-                    return True
-        return False
+        if self.timer_index.getTimer(ice_timer_id) is not None:
+            return True
+        return not ignoreCompleted and self.timer_index.getProcessedTimer(ice_timer_id) is not None
 
     def updateTimer(self, timer, name, start, end, eit, channels):
         changed = False
@@ -1145,44 +2528,53 @@ class EPGFetcher(object):
             _session.nav.RecordTimer.timeChanged(timer)
         return success
 
+    def blockingCall(self, f, *args, **kwargs):
+        # Call a method that returns a Deferred from a worker thread,
+        # and wait for its result
+        return threads.blockingCallFromThread(reactor, f, *args, **kwargs)
+
     def getSettings(self):
         req = ice.Settings()
-        res = req.get().json()
-        return res.get("settings", [])
+        return req.sendDeferred("get").addCallback(lambda res: res.json().get("settings", []))
 
-    def getShows(self, chan_list=None, fetch_timers=True):
+    def getShows(self, chan_list=None, fetch_timers=True, last_update=None):
         req = ice.Shows()
-        last_update = config.plugins.icetv.last_update_time.value
+        if last_update is None:
+            last_update = config.plugins.icetv.last_update_time.value
         req.params["last_update_time"] = last_update
         if chan_list:
             req.params["channel_id"] = ','.join(str(ch) for ch in chan_list)
         if not fetch_timers:
             req.params["hide_timers"] = 1
-        return req.get().json()
+        req.concurrency_limit = self.shows_limit
+        return req.streamDeferred()
 
     def getChannels(self):
         req = ice.UserChannels(config.plugins.icetv.member.region_id.value)
-        res = req.get().json()
-        return res.get("channels", [])
+        return req.sendDeferred("get").addCallback(lambda res: res.json().get("channels", []))
 
     def getAllChannels(self):
         req = ice.Channels(config.plugins.icetv.member.region_id.value)
-        res = req.get().json()
-        return res.get("channels", [])
+        return req.sendDeferred("get").addCallback(lambda res: res.json().get("channels", []))
 
     def getTimers(self):
         req = ice.Timers()
-        res = req.get().json()
-        return res.get("timers", [])
+        return req.sendDeferred("get").addCallback(lambda res: res.json().get("timers", []))
 
     def putTimers(self, timers):
+        # Send the timer updates that the server hasn't acknowledged
+        timers = self.timer_acks.unacknowledged(timers)
         if timers:
             req = ice.Timers()
             req.data["timers"] = timers
-            res = req.put().json()
-            return res.get("timers", [])
-        return []
+            return req.sendDeferred("put").addCallback(self.timersPut, timers)
+        return defer.succeed([])
 
+    def timersPut(self, res, timers):
+        self.timer_acks.acknowledge(timers)
+        return res.json().get("timers", [])
+
+    @defer.inlineCallbacks
     def putTimer(self, local_timer):
         try:
             # print("[IceTV] updating ice_timer", local_timer.ice_timer_id)
@@ -1192,6 +2584,7 @@ class EPGFetcher(object):
                 self.addLog("Timer '%s' has no event id; update not sent to IceTV" % local_timer.name)
                 return
             timer["id"] = local_timer.ice_timer_id
+            timer["name"] = local_timer.name
             timer["eit_id"] = local_timer.eit
             timer["start_time"] = strftime("%Y-%m-%dT%H:%M:%S+00:00", gmtime(local_timer.begin + config.recording.margin_before.value * 60))
             timer["duration_minutes"] = ((local_timer.end - config.recording.margin_after.value * 60) - (local_timer.begin + config.recording.margin_before.value * 60)) // 60
@@ -1208,15 +2601,17 @@ class EPGFetcher(object):
                 timer["state"] = "pending"
                 timer["message"] = "Will record on %s" % config.plugins.icetv.device.label.value
             req.data["timers"] = [timer]
-            res = req.put().json()
+            res = yield req.sendDeferred("put")
+            self.timer_acks.acknowledge([timer])
             self.addLog("Timer '%s' updated OK" % local_timer.name)
         except (IOError, RuntimeError, KeyError) as ex:
             _logResponseException(self, _("Can not update timer"), ex)
 
+    @defer.inlineCallbacks
     def postTimer(self, local_timer):
         if self.channel_service_map is None:
             try:
-                self.channel_service_map = self.makeChanServMap(self.getChannels())
+                yield self.refreshChannelMap()
             except (IOError, RuntimeError, KeyError) as ex:
                 _logResponseException(self, _("Can not retrieve channel map"), ex)
                 return
@@ -1240,12 +2635,13 @@ class EPGFetcher(object):
                 req.data["channel_id"] = channel_id
                 req.data["start_time"] = strftime("%Y-%m-%dT%H:%M:%S+00:00", gmtime(local_timer.begin + config.recording.margin_before.value * 60))
                 req.data["duration_minutes"] = ((local_timer.end - config.recording.margin_after.value * 60) - (local_timer.begin + config.recording.margin_before.value * 60)) // 60
-                res = req.post()
+                res = yield req.sendDeferred("post")
                 try:
                     local_timer.ice_timer_id = six.ensure_str(res.json()["timers"][0]["id"], "utf-8")
+                    self.timer_index.update(local_timer)
                     self.addLog("Timer '%s' created OK" % local_timer.name)
                     if local_timer.ice_timer_id is not None:
-                        NavigationInstance.instance.RecordTimer.saveTimer()
+                        self.server_state.saveTimers()
                         self.deferredPostStatus(local_timer)
                 except Exception:
                     self.addLog("Couldn't get IceTV timer id for timer '%s'" % local_timer.name)
@@ -1254,28 +2650,21 @@ class EPGFetcher(object):
                 _logResponseException(self, _("Can not upload timer"), ex)
         else:
             # Looks like a timer just added by IceTV, so this is an update
-            self.putTimer(local_timer)
+            yield self.putTimer(local_timer)
 
+    @defer.inlineCallbacks
     def deleteTimer(self, ice_timer_id):
         try:
             # print("[IceTV] deleting timer:", ice_timer_id)
             req = ice.Timer(ice_timer_id)
-            req.delete()
+            yield req.sendDeferred("delete")
             self.addLog("Timer deleted OK")
         except (IOError, RuntimeError, KeyError) as ex:
             _logResponseException(self, _("Can not delete timer"), ex)
 
     def postStatus(self, timer, state, message):
-        try:
-            channel_id = self.serviceToIceChannelId(timer.service_ref)
-            req = ice.Timer(timer.ice_timer_id)
-            req.data["message"] = message
-            req.data["state"] = state
-            # print("[EPGFetcher] postStatus", timer.name, message, state)
-            res = req.put()
-        except (IOError, RuntimeError, KeyError) as ex:
-            _logResponseException(self, _("Can not update timer status"), ex)
-        self.deferredPostStatus(timer)
+        # print("[EPGFetcher] postStatus", timer.name, message, state)
+        self.status_outbox.add(timer.ice_timer_id, state, message)
 
     def postScans(self):
         scan_list = self.getTriplets()
@@ -1284,7 +2673,7 @@ class EPGFetcher(object):
         try:
             req = ice.Scans()
             req.data["scans"] = scan_list
-            res = req.post()
+            res = self.blockingCall(req.sendDeferred, "post")
         except (IOError, RuntimeError, KeyError) as ex:
             _logResponseException(self, _("Can not post scan information"), ex)
 
@@ -1295,7 +2684,7 @@ class EPGFetcher(object):
         try:
             req = ice.PvrLogs()
             req.data["logs"] = log_list
-            res = req.post()
+            res = self.blockingCall(req.sendDeferred, "post")
             for lg in log_list:
                 lg.sent = True
         except (IOError, RuntimeError, KeyError) as ex:
@@ -1316,7 +2705,16 @@ def sessionstart_main(reason, session, **kwargs):
     elif reason == 1:
         _session = None
         fetcher.fetch_timer.stop()
+        fetcher.prewarm_timer.stop()
+        fetcher.retry_timer.stop()
+        fetcher.savePendingTimerUpdates()
+        if hasattr(language, "removeCallback"):
+            language.removeCallback(fetcher.languageChanged)
+        elif fetcher.languageChanged in language.callbacks:
+            language.callbacks.remove(fetcher.languageChanged)
         fetcher = None
+        ice.closeConnections()
+        epg_save_scheduler.flush()
 
 
 def plugin_main(session, **kwargs):
@@ -1330,6 +2728,7 @@ def plugin_main(session, **kwargs):
 
 def after_scan(**kwargs):
     if fetcher is not None:
+        fetcher.channel_map_builder.invalidate()
         fetcher.createFetchJob(send_scans=True)
 
 def Plugins(**kwargs):
@@ -1377,7 +2776,11 @@ class IceTVMain(ChoiceBox):
             ),
         ]
         if config.plugins.icetv.enable_epg.value:
-            menu.append((_("Fetch EPG and update timers now"), "CALLFUNC", self.fetch))
+            if fetcher.fetch_scheduler.state == FetchScheduler.RUNNING:
+                menu.append((_("Fetch EPG and update timers now") + " - " + fetcher.fetch_scheduler.getStatusText(), "CALLFUNC", self.fetch))
+            else:
+                menu.append((_("Fetch EPG and update timers now"), "CALLFUNC", self.fetch))
+            menu.append((_("Calibrate EPG batch size"), "CALLFUNC", self.calibrate))
         try:
             # Use windowTitle for compatibility betwwen OpenATV & OpenViX
             super(IceTVMain, self).__init__(session, title=_("IceTV version %s") % ice._version_string, list=menu, skin_name=self.skinName, windowTitle=_("IceTV - Setup"), selection=kwargs.get("selection", 0))
@@ -1422,14 +2825,39 @@ class IceTVMain(ChoiceBox):
         self.close()
 
     def fetch(self, res=None):
-        try:
-            if fetcher.doWork():
-                _session.open(MessageBox, _("IceTV update completed OK"), type=MessageBox.TYPE_INFO, timeout=5)
-                return
-        except (Exception) as ex:
-            fetcher.addLog("Error trying to fetch: %s" % str(ex))
+        # If a sync is already running, this fetch runs after it
+        if fetcher.fetch_scheduler.state == FetchScheduler.RUNNING:
+            _session.open(MessageBox, fetcher.fetch_scheduler.getStatusText() + "\n\n" + _("Another update will run when it finishes."), type=MessageBox.TYPE_INFO, timeout=5)
+        fetcher.fetch_scheduler.request().addBoth(self.fetchDone)
+
+    def fetchDone(self, res):
+        if isinstance(res, Failure):
+            fetcher.addLog("Error trying to fetch: %s" % res.getErrorMessage())
+        elif res:
+            _session.open(MessageBox, _("IceTV update completed OK"), type=MessageBox.TYPE_INFO, timeout=5)
+            return
         _session.open(MessageBox, _("IceTV update completed with errors.\n\nPlease check the log for details."), type=MessageBox.TYPE_ERROR, timeout=15)
 
+    def calibrate(self, res=None):
+        # A fetch running at the same time would skew the measurements
+        # and compete for memory
+        if fetcher.fetch_scheduler.state == FetchScheduler.RUNNING:
+            _session.open(MessageBox, fetcher.fetch_scheduler.getStatusText() + "\n\n" + _("Calibrate again when the update has finished."), type=MessageBox.TYPE_INFO, timeout=5)
+            return
+        # Imported here because calibrate imports from this module
+        from .calibrate import BatchSizeCalibration
+        calibration = BatchSizeCalibration(fetcher)
+        threads.deferToThread(calibration.run).addBoth(self.calibrateDone, calibration)
+
+    def calibrateDone(self, res, calibration):
+        if isinstance(res, Failure):
+            fetcher.addLog("Error trying to calibrate: %s" % res.getErrorMessage())
+            _session.open(MessageBox, _("IceTV calibration failed.\n\nPlease check the log for details."), type=MessageBox.TYPE_ERROR, timeout=15)
+            return
+        report = calibration.report(res)
+        print("[IceTV] calibration results\n" + report)
+        _session.open(IceTVLogView, report)
+
     def login(self, res=None):
         _session.open(IceTVNeedPassword)
 